@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2016, PagerDuty, Inc. <info@pagerduty.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of PagerDuty Inc nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL PAGERDUTY INC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+# Object type and payload key for each collection the stand-in serves
+COLLECTIONS = {
+    'schedules': 'schedule',
+    'escalation_policies': 'escalation_policy'
+}
+ID_CHARACTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+# LOCAL SERVER FUNCTIONS ######################################################
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server that handles each request on its own thread"""
+
+    daemon_threads = True
+
+
+class LocalPagerDuty():
+    """Class to house a local stand-in for the PagerDuty v2 REST API
+    endpoints used by PagerDutyREST, with a seeded directory of users and
+    teams, artificial latency, rate limiting and error injection.
+    Schedules and escalation policies are kept in memory by ID.
+    """
+
+    def __init__(self, num_users=100, num_teams=10, latency=0.0,
+                 rate_limit=None, rate_window=60.0, error_rate=0.0, seed=0,
+                 host='127.0.0.1', port=0):
+        self.latency = latency
+        # rate_limit is the number of requests allowed per rate_window
+        # seconds, after which requests get a 429 with Retry-After
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window_start = time.time()
+        self.window_count = 0
+        self.stats = {}
+        # Requests being answered now and the most seen at once
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.teams = [{
+            'id': self.get_id(),
+            'type': 'team',
+            'name': 'Team {number:06d}'.format(number=i + 1)
+        } for i in range(num_teams)]
+        self.users = []
+        for i in range(num_users):
+            user = {
+                'id': self.get_id(),
+                'type': 'user',
+                'name': 'User {number:06d}'.format(number=i + 1),
+                'email': 'user{number:06d}@example.com'.format(number=i + 1),
+                'teams': []
+            }
+            if self.teams:
+                team = self.teams[i % len(self.teams)]
+                user['teams'].append({
+                    'id': team['id'],
+                    'type': 'team_reference'
+                })
+            self.users.append(user)
+        self.objects = dict((name, {}) for name in COLLECTIONS)
+        self.server = ThreadingHTTPServer((host, port), self.get_handler())
+        # The URL to pass to PagerDutyREST as its base_url
+        self.base_url = 'http://{host}:{port}'.format(
+            host=self.server.server_address[0],
+            port=self.server.server_address[1]
+        )
+        self.thread = None
+
+    def start(self):
+        """Serve requests on a background thread and return the base URL"""
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        """Stop serving requests and close the listening socket"""
+
+        self.server.shutdown()
+        self.server.server_close()
+        if self.thread:
+            self.thread.join()
+
+    def add_user(self, name, email, team_ids=()):
+        """Add a user to the directory and return it"""
+
+        user = {
+            'id': self.get_id(),
+            'type': 'user',
+            'name': name,
+            'email': email,
+            'teams': [{'id': team_id, 'type': 'team_reference'}
+                      for team_id in team_ids]
+        }
+        with self.lock:
+            self.users.append(user)
+        return user
+
+    def add_team(self, name):
+        """Add a team to the directory and return it"""
+
+        team = {'id': self.get_id(), 'type': 'team', 'name': name}
+        with self.lock:
+            self.teams.append(team)
+        return team
+
+    def handle(self, method, path, params, body):
+        """Get the status code, headers and body for one request"""
+
+        parts = [part for part in path.split('/') if part]
+        with self.lock:
+            key = (method, parts[0] if parts else '')
+            self.stats[key] = self.stats.get(key, 0) + 1
+            throttled = self.get_retry_after()
+            failed = (not throttled and self.error_rate and
+                      self.random.random() < self.error_rate)
+        if throttled:
+            return 429, {'Retry-After': str(throttled)}, {
+                'error': {'message': 'Rate Limit Exceeded', 'code': 2020}
+            }
+        if failed:
+            return 500, {}, {'error': {'message': 'Injected error'}}
+        if method == 'GET' and parts in (['users'], ['teams']):
+            return 200, {}, self.get_list(parts[0], params)
+        if parts and parts[0] in COLLECTIONS:
+            type = COLLECTIONS[parts[0]]
+            objects = self.objects[parts[0]]
+            if method == 'GET' and len(parts) == 1:
+                return 200, {}, self.get_list(parts[0], params)
+            if method == 'PUT' and len(parts) == 2 and parts[1] in objects:
+                payload = dict(body.get(type, body))
+                payload['id'] = parts[1]
+                payload['type'] = type
+                with self.lock:
+                    objects[parts[1]] = payload
+                return 200, {}, {type: payload}
+            if method == 'POST' and len(parts) == 1:
+                # Accept bodies with or without the wrapping type key
+                payload = dict(body.get(type, body))
+                payload['id'] = self.get_id()
+                payload['type'] = type
+                with self.lock:
+                    objects[payload['id']] = payload
+                return 201, {}, {type: payload}
+            if method == 'DELETE' and len(parts) == 2:
+                with self.lock:
+                    deleted = objects.pop(parts[1], None)
+                if deleted:
+                    return 204, {}, None
+        return 404, {}, {'error': {'message': 'Not Found', 'code': 2100}}
+
+    def get_list(self, name, params):
+        """Get one page of a list endpoint filtered like the REST API"""
+
+        if name == 'users':
+            items = self.users
+        elif name == 'teams':
+            items = self.teams
+        else:
+            with self.lock:
+                items = sorted(self.objects[name].values(),
+                               key=lambda item: item['name'])
+        query = params.get('query', '').lower()
+        if query:
+            items = [item for item in items
+                     if query in item['name'].lower() or
+                     query in item.get('email', '').lower()]
+        team_ids = params.get('team_ids[]')
+        if team_ids:
+            items = [item for item in items
+                     if any(team['id'] == team_ids
+                            for team in item.get('teams', []))]
+        offset = int(params.get('offset', 0))
+        limit = min(int(params.get('limit', 25)), 100)
+        return {
+            name: items[offset:offset + limit],
+            'offset': offset,
+            'limit': limit,
+            'more': offset + limit < len(items),
+            'total': len(items) if params.get('total') == 'true' else None
+        }
+
+    def get_handler(self):
+        """Get the request handler class bound to this stand-in"""
+
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def respond(self):
+                url = urlparse.urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or '{}')
+                with stand_in.lock:
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight,
+                                                 stand_in.in_flight)
+                try:
+                    if stand_in.latency:
+                        time.sleep(stand_in.latency)
+                    status, headers, output = stand_in.handle(
+                        self.command,
+                        url.path,
+                        dict(urlparse.parse_qsl(url.query)),
+                        body
+                    )
+                finally:
+                    with stand_in.lock:
+                        stand_in.in_flight -= 1
+                output = '' if output is None else json.dumps(output)
+                self.send_response(status)
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(output)))
+                self.end_headers()
+                self.wfile.write(output)
+
+            do_GET = do_POST = do_PUT = do_DELETE = respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    # HELPER FUNCTIONS
+    def get_id(self):
+        """Helper function to generate a PagerDuty style object ID"""
+
+        return 'P' + ''.join(self.random.choice(ID_CHARACTERS)
+                             for i in range(6))
+
+    def get_retry_after(self):
+        """Helper function to count a request against the rate limit and
+        get the seconds to wait, or 0 when the request is allowed
+        """
+
+        if not self.rate_limit:
+            return 0
+        now = time.time()
+        if now - self.window_start >= self.rate_window:
+            self.window_start = now
+            self.window_count = 0
+        self.window_count += 1
+        if self.window_count <= self.rate_limit:
+            return 0
+        return int(math.ceil(self.window_start + self.rate_window - now))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Local stand-in for the PagerDuty REST API'
+    )
+    parser.add_argument(
+        '--port',
+        help='Port to listen on',
+        dest='port',
+        type=int,
+        default=8080
+    )
+    parser.add_argument(
+        '--users',
+        help='Number of users to seed the directory with',
+        dest='num_users',
+        type=int,
+        default=100
+    )
+    parser.add_argument(
+        '--teams',
+        help='Number of teams to seed the directory with',
+        dest='num_teams',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--latency',
+        help='Seconds to wait before answering each request',
+        dest='latency',
+        type=float,
+        default=0.0
+    )
+    parser.add_argument(
+        '--rate-limit',
+        help=('Number of requests allowed per --rate-window seconds before '
+              'answering with 429'),
+        dest='rate_limit',
+        type=int
+    )
+    parser.add_argument(
+        '--rate-window',
+        help='Length of the rate limit window in seconds',
+        dest='rate_window',
+        type=float,
+        default=60.0
+    )
+    parser.add_argument(
+        '--error-rate',
+        help='Fraction of requests to answer with a 500 error',
+        dest='error_rate',
+        type=float,
+        default=0.0
+    )
+    parser.add_argument(
+        '--seed',
+        help='Seed for the generated IDs and injected errors',
+        dest='seed',
+        type=int,
+        default=0
+    )
+    args = parser.parse_args()
+    stand_in = LocalPagerDuty(
+        num_users=args.num_users,
+        num_teams=args.num_teams,
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        rate_window=args.rate_window,
+        error_rate=args.error_rate,
+        seed=args.seed,
+        port=args.port
+    )
+    print "Serving the PagerDuty REST API stand-in at {url}".format(
+        url=stand_in.base_url
+    )
+    stand_in.server.serve_forever()
@@ -28,36 +28,705 @@
 import csv
 import glob
 import requests
+from requests.adapters import HTTPAdapter
 import json
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta
 import pytz
 import time
 import argparse
 import os
+import sys
+import random
+import threading
+from collections import OrderedDict
+import heapq
+import bisect
+import hashlib
+from multiprocessing.pool import ThreadPool
+
+# Status codes that signal a transient failure worth retrying. Server errors
+# are only retried for idempotent methods, as a POST may already have been
+# committed.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Methods that are safe to resend after a dropped connection or server error
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+# Largest page size accepted by the REST API list endpoints
+MAX_PAGE_SIZE = 100
+# Most users a weekly shift CSV may put on one escalation policy level a day
+MAX_LEVEL_TARGETS = 25
+# Upper bounds in seconds of the REST API latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+# Marks the description of objects managed by reconcile mode, followed by
+# the base name of the import that owns them
+FINGERPRINT_PREFIX = 'ScheduleDuty fingerprint: '
+FINGERPRINT_OWNER = ' base name: '
+DAY_NAMES = ('sunday', 'monday', 'tuesday', 'wednesday', 'thursday',
+             'friday', 'saturday')
+# Bitmask of the days covered by each day_of_week value, bit 0 is Sunday
+DAY_OF_WEEK_MASKS = dict((name, 1 << i) for i, name in enumerate(DAY_NAMES))
+DAY_OF_WEEK_MASKS.update((str(i), 1 << i) for i in range(7))
+DAY_OF_WEEK_MASKS.update(weekday=0b0111110, weekdays=0b0111110,
+                         weekend=0b1000001, weekends=0b1000001,
+                         all=0b1111111)
+# Python weekday (Monday is 0) for each day value accepted in a CSV
+WEEKDAYS = dict((name, (i - 1) % 7) for i, name in enumerate(DAY_NAMES))
+WEEKDAYS.update((i, (i - 1) % 7) for i in range(7))
+WEEKDAYS.update((str(i), (i - 1) % 7) for i in range(7))
+# Parsed times of day and dates, shared by every StandardRotationLogic
+TIME_OF_DAY_SECONDS = {}
+PARSED_DATES = {}
+# Parsed shift times, shared by every stage of the weekly shift logic
+SHIFT_SECONDS = {}
+# pytz timezones by name and ISO 8601 strings by (naive datetime, timezone)
+TIME_ZONES = {}
+LOCALIZED_DATETIMES = {}
+# Days of the week in each possible bitmask
+DAY_OF_WEEK_INDEXES = dict(
+    (mask, tuple(i for i in range(7) if mask & 1 << i))
+    for mask in range(1 << 7)
+)
+
+
+# TIME ZONE FUNCTIONS #########################################################
+def get_time_zone(time_zone):
+    """Get the pytz timezone for a name, resolving each name only once"""
+
+    if time_zone not in TIME_ZONES:
+        TIME_ZONES[time_zone] = pytz.timezone(time_zone)
+    return TIME_ZONES[time_zone]
+
+
+def get_localized_isoformat(naive_datetime, tz):
+    """Get the ISO 8601 string of a naive datetime localized to a pytz
+    timezone, formatting each pair only once
+    """
+
+    key = (naive_datetime, tz)
+    if key not in LOCALIZED_DATETIMES:
+        LOCALIZED_DATETIMES[key] = tz.localize(naive_datetime).isoformat()
+    return LOCALIZED_DATETIMES[key]
+
+
+# TRACING FUNCTIONS ###########################################################
+class Span():
+    """Class to time one block of an import as a trace span"""
+
+    def __init__(self, tracer, name, category, args, file=None):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.file = file
+        self.previous_file = None
+        self.start = None
+
+    def set(self, **args):
+        """Add attributes to the span, such as row or schedule counts"""
+
+        self.args.update(args)
+
+    def __enter__(self):
+        if self.file is not None:
+            self.previous_file = self.tracer.set_file(self.file)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is not None:
+            self.args['error'] = '{error}'.format(error=value)
+        self.tracer.add(
+            self.name,
+            self.category,
+            self.start,
+            time.time(),
+            self.args
+        )
+        if self.file is not None:
+            self.tracer.set_file(self.previous_file)
+
+
+class Tracer():
+    """Class to collect the spans of an import and write them to a file in
+    the Chrome trace event format. Each CSV file is written as its own
+    process, so every span of a file is grouped under it whichever thread
+    recorded it.
+    """
+
+    def __init__(self, enabled=True):
+        # A disabled tracer still hands out spans but keeps nothing
+        self.enabled = enabled
+        self.events = []
+        self.lock = threading.Lock()
+        self.start = time.time()
+        # Trace process ID of each file, 0 for work outside of any file
+        self.pids = {None: 0}
+        # File the calling thread is working on
+        self.local = threading.local()
+
+    def span(self, name, category='stage', file=None, **args):
+        """Get a span to use as a context manager around a stage. Passing a
+        file records the span, and every span inside it on the same thread,
+        under that file.
+        """
+
+        return Span(self, name, category, args, file)
+
+    def get_file(self):
+        """Get the file the calling thread is working on"""
+
+        return getattr(self.local, 'file', None)
+
+    def set_file(self, file):
+        """Set the file the calling thread is working on and return the
+        previous one
+        """
+
+        previous = self.get_file()
+        self.local.file = file
+        return previous
+
+    def bind(self, function):
+        """Wrap a function handed to a thread pool so its spans are recorded
+        under the calling thread's file
+        """
+
+        file = self.get_file()
+
+        def bound(*args):
+            previous = self.set_file(file)
+            try:
+                return function(*args)
+            finally:
+                self.set_file(previous)
+        return bound
+
+    def add(self, name, category, start, end, args):
+        """Record a finished span on the calling thread. Spans on the same
+        thread nest by time, so a file span contains its stage spans.
+        """
+
+        if not self.enabled:
+            return
+        file = self.get_file()
+        if file is not None:
+            args = dict(args, file=file)
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int((start - self.start) * 1000000),
+            'dur': int((end - start) * 1000000),
+            'tid': threading.current_thread().ident,
+            'args': args
+        }
+        with self.lock:
+            if file not in self.pids:
+                self.pids[file] = len(self.pids)
+            event['pid'] = self.pids[file]
+            self.events.append(event)
+
+    def get_events(self):
+        """Get a copy of the recorded events sorted by start time, after a
+        metadata event naming each file's process
+        """
+
+        with self.lock:
+            names = [{
+                'name': 'process_name',
+                'ph': 'M',
+                'pid': pid,
+                'tid': 0,
+                'args': {'name': file or 'scheduleduty'}
+            } for file, pid in sorted(self.pids.items(),
+                                      key=lambda item: item[1])]
+            return names + sorted(self.events, key=lambda event: event['ts'])
+
+    def write(self, filename):
+        """Write the spans to a JSON file that chrome://tracing and Perfetto
+        can load
+        """
+
+        with open(filename, 'w') as f:
+            json.dump({
+                'traceEvents': self.get_events(),
+                'displayTimeUnit': 'ms'
+            }, f)
 
 
 # PD REST API FUNCTION #######################################################
+def get_directory_key(kind, query):
+    """Normalize a user or team lookup into a directory and cache key"""
+
+    return (kind, ('%s' % query).strip().lower())
+
+
+def index_directory(users, teams):
+    """Index users and teams by name, email and ID. Each team ID also maps
+    to the list of users on that team.
+    """
+
+    directory = {}
+
+    def add(kind, query, value):
+        key = get_directory_key(kind, query)
+        # Names shared by more than one object must go to the API
+        if key in directory and directory[key] != value:
+            directory[key] = None
+        else:
+            directory[key] = value
+
+    for team in teams:
+        add('team', team['name'], team['id'])
+        add('team', team['id'], team['id'])
+        directory[get_directory_key('team_users', team['id'])] = []
+    for user in users:
+        add('user', user['name'], user['id'])
+        add('user', user['email'], user['id'])
+        add('user', user['id'], user['id'])
+        for team in user.get('teams', []):
+            key = get_directory_key('team_users', team['id'])
+            directory.setdefault(key, []).append(user)
+    return directory
+
+
+class TokenBucket():
+    """Class to throttle requests to a sustained rate while allowing bursts"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+
+        while True:
+            with self.lock:
+                now = time.time()
+                # updated is in the future while the bucket is paused
+                if now > self.updated:
+                    self.tokens = min(
+                        self.capacity,
+                        self.tokens + (now - self.updated) * self.rate
+                    )
+                    self.updated = now
+                if self.tokens >= 1 and now >= self.updated:
+                    self.tokens -= 1
+                    return
+                wait = (max(self.updated - now, 0) +
+                        (1 - min(self.tokens, 1)) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Empty the bucket and stop refilling it for a number of seconds"""
+
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = max(self.updated, time.time() + seconds)
+
+
+class ResolutionCache():
+    """Class to memoize user and team lookups with a TTL and a size bound"""
+
+    def __init__(self, ttl=3600, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, kind, query):
+        """Get a cached value, or None if it is missing or expired"""
+
+        key = self.get_key(kind, query)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            expires, value = self.entries.pop(key)
+            if self.ttl and expires < time.time():
+                return None
+            # Re-insert to mark the entry as most recently used
+            self.entries[key] = (expires, value)
+            return value
+
+    def set(self, kind, query, value):
+        """Cache a value, evicting the least recently used entry if full"""
+
+        key = self.get_key(kind, query)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + (self.ttl or 0), value)
+            while self.max_size and len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all cached values"""
+
+        with self.lock:
+            self.entries.clear()
+
+    # HELPER FUNCTIONS
+    def get_key(self, kind, query):
+        """Helper function to normalize a lookup into a cache key"""
+
+        return get_directory_key(kind, query)
+
+
+class RequestMetrics():
+    """Class to count REST API calls per client operation, method and
+    endpoint along with their status codes, retries, bytes and latency
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def record(self, operation, method, endpoint, status_code, retries,
+               bytes_sent, bytes_received, seconds):
+        """Record one call, including all of its retries. The operation is
+        the PagerDutyREST method that made it, such as get_user_id.
+        """
+
+        with self.lock:
+            key = (operation, method, endpoint)
+            if key not in self.endpoints:
+                self.endpoints[key] = {
+                    'operation': operation,
+                    'method': method,
+                    'endpoint': endpoint,
+                    'calls': 0,
+                    'retries': 0,
+                    'status_codes': {},
+                    'bytes_sent': 0,
+                    'bytes_received': 0,
+                    'seconds': 0.0,
+                    'latency_buckets': [0] * (len(self.buckets) + 1)
+                }
+            stats = self.endpoints[key]
+            stats['calls'] += 1
+            stats['retries'] += retries
+            status_code = '{status_code}'.format(status_code=status_code)
+            stats['status_codes'][status_code] = (
+                stats['status_codes'].get(status_code, 0) + 1
+            )
+            stats['bytes_sent'] += bytes_sent
+            stats['bytes_received'] += bytes_received
+            stats['seconds'] += seconds
+            stats['latency_buckets'][bisect.bisect_left(self.buckets,
+                                                        seconds)] += 1
+
+    def snapshot(self):
+        """Get a copy of the metrics, sorted by endpoint, method and
+        operation
+        """
+
+        with self.lock:
+            endpoints = [self.endpoints[key]
+                         for key in sorted(self.endpoints,
+                                           key=lambda key: (key[2], key[1],
+                                                            key[0]))]
+            return {
+                'latency_buckets': list(self.buckets),
+                'endpoints': [dict(
+                    stats,
+                    status_codes=dict(stats['status_codes']),
+                    latency_buckets=list(stats['latency_buckets'])
+                ) for stats in endpoints]
+            }
+
+    def write_json(self, filename):
+        """Write a snapshot of the metrics to a JSON file"""
+
+        with open(filename, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2, separators=(',', ': '),
+                      sort_keys=True)
+            f.write('\n')
+
+    def write_prometheus(self, filename):
+        """Write a snapshot of the metrics to a file in the Prometheus text
+        exposition format
+        """
+
+        snapshot = self.snapshot()
+        lines = []
+
+        def add(name, type, help, samples):
+            lines.append('# HELP {name} {help}'.format(name=name, help=help))
+            lines.append('# TYPE {name} {type}'.format(name=name, type=type))
+            for suffix, labels, value in samples:
+                label_text = ','.join(
+                    '{key}="{value}"'.format(key=key, value=value)
+                    for key, value in labels
+                )
+                lines.append('{name}{suffix}{{{labels}}} {value}'.format(
+                    name=name,
+                    suffix=suffix,
+                    labels=label_text,
+                    value=value
+                ))
+
+        def get_labels(stats, *labels):
+            return (('operation', stats['operation']),
+                    ('method', stats['method']),
+                    ('endpoint', stats['endpoint'])) + labels
+
+        endpoints = snapshot['endpoints']
+        add('scheduleduty_api_requests_total', 'counter',
+            'REST API calls by final status code',
+            [('', get_labels(stats, ('status', status_code)), count)
+             for stats in endpoints
+             for status_code, count in sorted(stats['status_codes'].items())])
+        add('scheduleduty_api_retries_total', 'counter',
+            'REST API attempts repeated after a failure',
+            [('', get_labels(stats), stats['retries'])
+             for stats in endpoints])
+        add('scheduleduty_api_sent_bytes_total', 'counter',
+            'Request body bytes sent to the REST API',
+            [('', get_labels(stats), stats['bytes_sent'])
+             for stats in endpoints])
+        add('scheduleduty_api_received_bytes_total', 'counter',
+            'Response body bytes received from the REST API',
+            [('', get_labels(stats), stats['bytes_received'])
+             for stats in endpoints])
+        samples = []
+        for stats in endpoints:
+            total = 0
+            for bucket, count in zip(
+                    ['{bucket}'.format(bucket=bucket)
+                     for bucket in snapshot['latency_buckets']] + ['+Inf'],
+                    stats['latency_buckets']):
+                total += count
+                samples.append(('_bucket', get_labels(stats, ('le', bucket)),
+                                total))
+            samples.append(('_sum', get_labels(stats), stats['seconds']))
+            samples.append(('_count', get_labels(stats), stats['calls']))
+        add('scheduleduty_api_request_duration_seconds', 'histogram',
+            'REST API call latency including retries', samples)
+        with open(filename, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
 class PagerDutyREST():
     """Class to house all PagerDuty REST API call methods"""
 
-    def __init__(self, api_key):
-        self.base_url = 'https://api.pagerduty.com'
+    def __init__(self, api_key, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, keep_alive=True, rate_limit=960,
+                 burst=None, max_retries=5, backoff_base=1.0,
+                 backoff_cap=60.0, cache_ttl=3600, cache_size=10000,
+                 base_url='https://api.pagerduty.com'):
+        # Override base_url to point at a proxy or a local stand-in
+        self.base_url = base_url.rstrip('/')
         self.headers = {
             'Accept': 'application/vnd.pagerduty+json;version=2',
             'Content-type': 'application/json',
             'Authorization': 'Token token={token}'.format(token=api_key)
         }
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+        # Share one pooled session across every call so connections are reused
+        # pool_connections: number of per-host pools to cache
+        # pool_maxsize: maximum number of connections kept open per host
+        # pool_block: wait for a free connection instead of exceeding maxsize
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # rate_limit is in requests per minute, matching the REST API limit
+        if rate_limit:
+            self.bucket = TokenBucket(
+                rate_limit / 60.0,
+                burst or max(rate_limit / 60.0, 1)
+            )
+        else:
+            self.bucket = None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        # Resolved users and teams are shared by every file in an import
+        self.cache = ResolutionCache(cache_ttl, cache_size)
+        # Local index of the account directory, filled by prefetch_directory
+        self.directory = {}
+        self.metrics = RequestMetrics()
+        # Set to a Tracer to record every call as an http span
+        self.tracer = None
+
+    def close(self):
+        """Close all pooled connections"""
+
+        self.session.close()
+
+    def request(self, method, url, operation='request', **kwargs):
+        """Send a throttled request, retrying rate limited and failed calls
+        with jittered exponential backoff, and record it in the metrics
+        under the name of the calling operation
+        """
+
+        attempt = 0
+        received = 0
+        start = time.time()
+        try:
+            while True:
+                r = None
+                if self.bucket:
+                    self.bucket.acquire()
+                try:
+                    r = self.session.request(method, url, **kwargs)
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout):
+                    if (attempt >= self.max_retries or
+                            method not in IDEMPOTENT_METHODS):
+                        raise
+                if r is not None:
+                    received += len(r.content)
+                    if (r.status_code not in RETRY_STATUS_CODES or
+                            (r.status_code != 429 and
+                             method not in IDEMPOTENT_METHODS)):
+                        return r
+                if attempt >= self.max_retries:
+                    return r
+                delay = self.get_backoff(attempt, r)
+                if r is not None and r.status_code == 429 and self.bucket:
+                    # Hold back every caller sharing this client, not just
+                    # this one
+                    self.bucket.pause(delay)
+                time.sleep(delay)
+                attempt += 1
+        finally:
+            end = time.time()
+            status_code = r.status_code if r is not None else 'error'
+            self.metrics.record(
+                operation,
+                method,
+                self.get_endpoint(url),
+                status_code,
+                attempt,
+                len(kwargs.get('data') or '') * (attempt + 1),
+                received,
+                end - start
+            )
+            if self.tracer:
+                self.tracer.add(
+                    '{method} {endpoint}'.format(
+                        method=method,
+                        endpoint=self.get_endpoint(url)
+                    ),
+                    'http',
+                    start,
+                    end,
+                    {'operation': operation, 'status': status_code,
+                     'retries': attempt}
+                )
+
+    def get_metrics(self):
+        """Get a snapshot of the calls made by this client"""
+
+        return self.metrics.snapshot()
+
+    def get_endpoint(self, url):
+        """Get the path of a URL with object IDs replaced by {id}"""
+
+        path = url[len(self.base_url):].split('?')[0]
+        parts = path.strip('/').split('/')
+        return '/' + '/'.join(parts[:1] + ['{id}'] * len(parts[1:]))
+
+    def get_backoff(self, attempt, response):
+        """Get the number of seconds to wait before the next attempt"""
+
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return float(retry_after) + random.uniform(0, 1)
+                except ValueError:
+                    pass
+        return random.uniform(
+            0,
+            min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+        )
+
+    def get_all(self, path, key, params=None, workers=4):
+        """GET every object from a list endpoint, fetching the remaining
+        pages in parallel once the total is known
+        """
+
+        url = '{base_url}{path}'.format(base_url=self.base_url, path=path)
+
+        def get_page(offset):
+            payload = dict(params or {})
+            payload.update({
+                'limit': MAX_PAGE_SIZE,
+                'offset': offset,
+                'total': 'true'
+            })
+            r = self.request('GET', url, operation='get_all', params=payload)
+            if r.status_code == 200:
+                return r.json()
+            else:
+                raise ValueError(
+                    'get_all returned status code {status_code}\n'
+                    '{error_body}'.format(
+                        status_code=r.status_code,
+                        error_body=r.text
+                    )
+                )
+
+        first = get_page(0)
+        output = list(first[key])
+        if not first.get('more'):
+            return output
+        if first.get('total') is None:
+            # Fall back to walking the pages in series
+            page = first
+            while page.get('more'):
+                page = get_page(len(output))
+                output.extend(page[key])
+            return output
+        offsets = range(MAX_PAGE_SIZE, first['total'], MAX_PAGE_SIZE)
+        if self.tracer:
+            get_page = self.tracer.bind(get_page)
+        pool = ThreadPool(max(1, min(workers, len(offsets))))
+        try:
+            for page in pool.map(get_page, offsets):
+                output.extend(page[key])
+        finally:
+            pool.close()
+        return output
+
+    def prefetch_directory(self, workers=4):
+        """GET all users and teams up front and index them by name, email
+        and ID so later lookups are answered locally
+        """
+
+        self.directory = index_directory(
+            self.get_all('/users', 'users', workers=workers),
+            self.get_all('/teams', 'teams', workers=workers)
+        )
+        return self.directory
 
     def get_team_id(self, team_name):
         """GET the team ID from team name"""
 
+        team_id = (self.cache.get('team', team_name) or
+                   self.directory.get(self.cache.get_key('team', team_name)))
+        if team_id:
+            return team_id
         url = '{base_url}/teams'.format(base_url=self.base_url)
         payload = {
             'query': team_name
         }
-        r = requests.get(url, params=payload, headers=self.headers)
+        r = self.request('GET', url, operation='get_team_id', params=payload)
         if r.status_code == 200:
-            return r.json()['teams'][0]['id']
+            team_id = r.json()['teams'][0]['id']
+            self.cache.set('team', team_name, team_id)
+            return team_id
         else:
             raise ValueError('get_team_id returned status code {status_code}'
                              .format(status_code=r.status_code))
@@ -65,28 +734,84 @@ class PagerDutyREST():
     def get_users_in_team(self, team_id):
         """GET a list of users from the team ID"""
 
+        return list(self.iter_users_in_team(team_id))
+
+    def iter_users_in_team(self, team_id, page_size=MAX_PAGE_SIZE):
+        """GET the users from the team ID page by page, fetching the next
+        page while the current one is being consumed
+        """
+
+        if page_size < 1 or page_size > MAX_PAGE_SIZE:
+            raise ValueError('page_size must be between 1 and {max}'.format(
+                max=MAX_PAGE_SIZE
+            ))
+        users = self.cache.get('team_users', team_id)
+        if users is None:
+            users = self.directory.get(
+                self.cache.get_key('team_users', team_id)
+            )
+        if users is not None:
+            for user in users:
+                yield user
+            return
         url = '{base_url}/users'.format(base_url=self.base_url)
-        payload = {
-            'team_ids[]': team_id,
-            'limit': 26
-        }
-        r = requests.get(url, params=payload, headers=self.headers)
-        if r.status_code == 200:
-            return r.json()['users']
-        else:
-            raise ValueError(
-                'get_team_id returned status code {status_code}\n{error_body}'
-                .format(status_code=r.status_code, error_body=r.text)
+
+        def get_page(offset):
+            payload = {
+                'team_ids[]': team_id,
+                'limit': page_size,
+                'offset': offset
+            }
+            r = self.request(
+                'GET',
+                url,
+                operation='iter_users_in_team',
+                params=payload
             )
+            if r.status_code == 200:
+                return r.json()
+            else:
+                raise ValueError(
+                    'get_users_in_team returned status code {status_code}\n'
+                    '{error_body}'.format(
+                        status_code=r.status_code,
+                        error_body=r.text
+                    )
+                )
+
+        output = []
+        pool = ThreadPool(1)
+        try:
+            page = get_page(0)
+            while True:
+                next_page = None
+                if page.get('more'):
+                    next_page = pool.apply_async(
+                        get_page,
+                        (len(output) + len(page['users']),)
+                    )
+                for user in page['users']:
+                    output.append(user)
+                    yield user
+                if next_page is None:
+                    break
+                page = next_page.get()
+        finally:
+            pool.close()
+        self.cache.set('team_users', team_id, output)
 
     def get_user_id(self, user_query):
         """GET the user ID from the user name or email"""
 
+        user_id = (self.cache.get('user', user_query) or
+                   self.directory.get(self.cache.get_key('user', user_query)))
+        if user_id:
+            return user_id
         url = '{base_url}/users'.format(base_url=self.base_url)
         payload = {
             'query': user_query
         }
-        r = requests.get(url, params=payload, headers=self.headers)
+        r = self.request('GET', url, operation='get_user_id', params=payload)
         if r.status_code == 200:
             if len(r.json()['users']) > 1:
                 raise ValueError('Found more than one user for {query}. '
@@ -94,7 +819,11 @@ class PagerDutyREST():
                                     query=user_query
                                  ))
             else:
-                return r.json()['users'][0]['id']
+                user_id = r.json()['users'][0]['id']
+                self.cache.set('user', user_query, user_id)
+                # Entries already resolved to an ID resolve to themselves
+                self.cache.set('user', user_id, user_id)
+                return user_id
         else:
             raise ValueError(
                 'get_user_id returned status code {status_code}\n{error_body}'
@@ -105,7 +834,12 @@ class PagerDutyREST():
         """Create a schedule"""
 
         url = '{base_url}/schedules'.format(base_url=self.base_url)
-        r = requests.post(url, data=json.dumps(payload), headers=self.headers)
+        r = self.request(
+            'POST',
+            url,
+            operation='create_schedule',
+            data=json.dumps(payload)
+        )
         if r.status_code == 201:
             return r.json()
         else:
@@ -115,6 +849,28 @@ class PagerDutyREST():
                                 error_body=r.text
                              ))
 
+    def update_schedule(self, schedule_id, payload):
+        """Update a schedule in place"""
+
+        url = '{base_url}/schedules/{id}'.format(
+            base_url=self.base_url,
+            id=schedule_id
+        )
+        r = self.request(
+            'PUT',
+            url,
+            operation='update_schedule',
+            data=json.dumps(payload)
+        )
+        if r.status_code == 200:
+            return r.json()
+        else:
+            raise ValueError('update_schedule returned status code '
+                             '{status_code}\n{error_body}'.format(
+                                status_code=r.status_code,
+                                error_body=r.text
+                             ))
+
     def delete_schedule(self, schedule_id):
         """Delete a schedule"""
 
@@ -122,7 +878,7 @@ class PagerDutyREST():
             base_url=self.base_url,
             id=schedule_id
         )
-        r = requests.delete(url, headers=self.headers)
+        r = self.request('DELETE', url, operation='delete_schedule')
         if r.status_code == 204:
             return r.status_code
         else:
@@ -136,7 +892,12 @@ class PagerDutyREST():
         """Create an escalation policy"""
 
         url = '{base_url}/escalation_policies'.format(base_url=self.base_url)
-        r = requests.post(url, data=json.dumps(payload), headers=self.headers)
+        r = self.request(
+            'POST',
+            url,
+            operation='create_escalation_policy',
+            data=json.dumps(payload)
+        )
         if r.status_code == 201:
             return r.json()
         else:
@@ -146,6 +907,28 @@ class PagerDutyREST():
                                 error_body=r.text
                              ))
 
+    def update_escalation_policy(self, escalation_policy_id, payload):
+        """Update an escalation policy in place"""
+
+        url = '{base_url}/escalation_policies/{id}'.format(
+            base_url=self.base_url,
+            id=escalation_policy_id
+        )
+        r = self.request(
+            'PUT',
+            url,
+            operation='update_escalation_policy',
+            data=json.dumps(payload)
+        )
+        if r.status_code == 200:
+            return r.json()
+        else:
+            raise ValueError('update_escalation_policy returned status code '
+                             '{status_code}\n{error_body}'.format(
+                                status_code=r.status_code,
+                                error_body=r.text
+                             ))
+
     def delete_escalation_policy(self, escalation_policy_id):
         """Delete an escalation policy"""
 
@@ -153,7 +936,7 @@ class PagerDutyREST():
             base_url=self.base_url,
             id=escalation_policy_id
         )
-        r = requests.delete(url, headers=self.headers)
+        r = self.request('DELETE', url, operation='delete_escalation_policy')
         if r.status_code == 204:
             return r.status_code
         else:
@@ -164,7 +947,657 @@ class PagerDutyREST():
                              ))
 
 
+class AsyncPagerDutyREST():
+    """Class to make PagerDuty REST API calls in background threads, one
+    per in-flight call. Each method returns an AsyncResult that can be
+    waited on with get() or handed a callback.
+    """
+
+    def __init__(self, api_key, concurrency=10, **kwargs):
+        kwargs.setdefault('pool_maxsize', concurrency)
+        self.pd_rest = PagerDutyREST(api_key, **kwargs)
+        # The worker count bounds how many calls are in flight at once
+        self.pool = ThreadPool(concurrency)
+
+    def get_team_id(self, team_name, callback=None):
+        """GET the team ID from team name"""
+
+        return self.pool.apply_async(self.pd_rest.get_team_id, (team_name,),
+                                     callback=callback)
+
+    def get_users_in_team(self, team_id, callback=None):
+        """GET a list of users from the team ID"""
+
+        return self.pool.apply_async(self.pd_rest.get_users_in_team,
+                                     (team_id,), callback=callback)
+
+    def get_user_id(self, user_query, callback=None):
+        """GET the user ID from the user name or email"""
+
+        return self.pool.apply_async(self.pd_rest.get_user_id, (user_query,),
+                                     callback=callback)
+
+    def create_schedule(self, payload, callback=None):
+        """Create a schedule"""
+
+        return self.pool.apply_async(self.pd_rest.create_schedule, (payload,),
+                                     callback=callback)
+
+    def update_schedule(self, schedule_id, payload, callback=None):
+        """Update a schedule in place"""
+
+        return self.pool.apply_async(self.pd_rest.update_schedule,
+                                     (schedule_id, payload),
+                                     callback=callback)
+
+    def delete_schedule(self, schedule_id, callback=None):
+        """Delete a schedule"""
+
+        return self.pool.apply_async(self.pd_rest.delete_schedule,
+                                     (schedule_id,), callback=callback)
+
+    def create_escalation_policy(self, payload, callback=None):
+        """Create an escalation policy"""
+
+        return self.pool.apply_async(self.pd_rest.create_escalation_policy,
+                                     (payload,), callback=callback)
+
+    def update_escalation_policy(self, escalation_policy_id, payload,
+                                 callback=None):
+        """Update an escalation policy in place"""
+
+        return self.pool.apply_async(self.pd_rest.update_escalation_policy,
+                                     (escalation_policy_id, payload),
+                                     callback=callback)
+
+    def delete_escalation_policy(self, escalation_policy_id, callback=None):
+        """Delete an escalation policy"""
+
+        return self.pool.apply_async(self.pd_rest.delete_escalation_policy,
+                                     (escalation_policy_id,),
+                                     callback=callback)
+
+    def close(self):
+        """Wait for the calls in flight and close all pooled connections"""
+
+        self.pool.close()
+        self.pool.join()
+        self.pd_rest.close()
+
+
+class LocalResolver():
+    """Class to resolve users and teams from a local copy of the directory
+    in the format returned by the /users and /teams endpoints
+    """
+
+    def __init__(self, users, teams):
+        self.directory = index_directory(users, teams)
+
+    def prefetch_directory(self, workers=4):
+        """The directory is already local, so return it as is"""
+
+        return self.directory
+
+    def get_team_id(self, team_name):
+        """Get the team ID from team name"""
+
+        team_id = self.directory.get(get_directory_key('team', team_name))
+        if not team_id:
+            raise ValueError('No single team found matching {team_name}'
+                             .format(team_name=team_name))
+        return team_id
+
+    def get_users_in_team(self, team_id):
+        """Get a list of users from the team ID"""
+
+        return list(self.iter_users_in_team(team_id))
+
+    def iter_users_in_team(self, team_id, page_size=MAX_PAGE_SIZE):
+        """Yield the users on a team from the team ID"""
+
+        return iter(self.directory.get(
+            get_directory_key('team_users', team_id),
+            []
+        ))
+
+    def get_user_id(self, user_query):
+        """Get the user ID from the user name or email"""
+
+        user_id = self.directory.get(get_directory_key('user', user_query))
+        if not user_id:
+            raise ValueError('No single user found matching {user_query}'
+                             .format(user_query=user_query))
+        return user_id
+
+    def close(self):
+        """Nothing to close for a local directory"""
+
+        pass
+
+
+class DryRunREST():
+    """Class to stand in for PagerDutyREST without changing anything in
+    PagerDuty. Users and teams are looked up with a resolver and each create
+    call is written to a JSONL stream along with a placeholder ID.
+    """
+
+    def __init__(self, output, resolver):
+        self.output = output
+        # Any object with the PagerDutyREST lookup methods, such as a
+        # LocalResolver or a PagerDutyREST instance
+        self.resolver = resolver
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def prefetch_directory(self, workers=4):
+        """Index the resolver's users and teams up front"""
+
+        return self.resolver.prefetch_directory(workers)
+
+    def get_team_id(self, team_name):
+        """Get the team ID from team name"""
+
+        return self.resolver.get_team_id(team_name)
+
+    def get_users_in_team(self, team_id):
+        """Get a list of users from the team ID"""
+
+        return self.resolver.get_users_in_team(team_id)
+
+    def iter_users_in_team(self, team_id, page_size=MAX_PAGE_SIZE):
+        """Yield the users on a team from the team ID"""
+
+        return self.resolver.iter_users_in_team(team_id, page_size)
+
+    def get_user_id(self, user_query):
+        """Get the user ID from the user name or email"""
+
+        return self.resolver.get_user_id(user_query)
+
+    def create_schedule(self, payload):
+        """Write a schedule payload instead of creating it"""
+
+        return {'schedule': {'id': self.write('schedule', payload)}}
+
+    def create_escalation_policy(self, payload):
+        """Write an escalation policy payload instead of creating it"""
+
+        return {
+            'escalation_policy': {
+                'id': self.write('escalation_policy', payload)
+            }
+        }
+
+    def write(self, type, payload):
+        """Write one payload as a line of JSON and return its placeholder
+        ID
+        """
+
+        with self.lock:
+            self.count += 1
+            object_id = 'DRYRUN{count}'.format(count=self.count)
+            self.output.write(json.dumps({
+                'type': type,
+                'id': object_id,
+                'payload': payload
+            }, sort_keys=True) + '\n')
+        return object_id
+
+    def close(self):
+        """Close the resolver"""
+
+        self.resolver.close()
+
+
+class DelegatingREST():
+    """Class to wrap PagerDutyREST, passing every call through to it.
+    Subclasses override the calls they change.
+    """
+
+    def __init__(self, pd_rest):
+        self.pd_rest = pd_rest
+
+    def prefetch_directory(self, workers=4):
+        """Index all users and teams up front"""
+
+        return self.pd_rest.prefetch_directory(workers)
+
+    def get_all(self, path, key, params=None, workers=4):
+        """GET every object from a list endpoint"""
+
+        return self.pd_rest.get_all(path, key, params, workers)
+
+    def get_team_id(self, team_name):
+        """Get the team ID from team name"""
+
+        return self.pd_rest.get_team_id(team_name)
+
+    def get_users_in_team(self, team_id):
+        """Get a list of users from the team ID"""
+
+        return self.pd_rest.get_users_in_team(team_id)
+
+    def iter_users_in_team(self, team_id, page_size=MAX_PAGE_SIZE):
+        """Yield the users on a team from the team ID"""
+
+        return self.pd_rest.iter_users_in_team(team_id, page_size)
+
+    def get_user_id(self, user_query):
+        """Get the user ID from the user name or email"""
+
+        return self.pd_rest.get_user_id(user_query)
+
+    def create_schedule(self, payload):
+        """Create a schedule"""
+
+        return self.pd_rest.create_schedule(payload)
+
+    def update_schedule(self, schedule_id, payload):
+        """Update a schedule in place"""
+
+        return self.pd_rest.update_schedule(schedule_id, payload)
+
+    def delete_schedule(self, schedule_id):
+        """Delete a schedule"""
+
+        return self.pd_rest.delete_schedule(schedule_id)
+
+    def create_escalation_policy(self, payload):
+        """Create an escalation policy"""
+
+        return self.pd_rest.create_escalation_policy(payload)
+
+    def update_escalation_policy(self, escalation_policy_id, payload):
+        """Update an escalation policy in place"""
+
+        return self.pd_rest.update_escalation_policy(escalation_policy_id,
+                                                     payload)
+
+    def delete_escalation_policy(self, escalation_policy_id):
+        """Delete an escalation policy"""
+
+        return self.pd_rest.delete_escalation_policy(escalation_policy_id)
+
+    def close(self):
+        """Close all pooled connections"""
+
+        self.pd_rest.close()
+
+
+class ReconcilingREST(DelegatingREST):
+    """Class to wrap PagerDutyREST so that importing a file again only
+    changes what differs from PagerDuty. A schedule or escalation policy
+    that already exists under the same name is reused when its payload is
+    unchanged and updated in place otherwise. Each payload's fingerprint is
+    kept in its description to tell the two apart, along with the base name
+    so that only objects of this import are ever deleted.
+    """
+
+    def __init__(self, pd_rest, base_name, workers=4):
+        DelegatingREST.__init__(self, pd_rest)
+        self.base_name = base_name
+        self.lock = threading.Lock()
+        self.used = set()
+        self.counts = {'created': 0, 'updated': 0, 'unchanged': 0,
+                       'deleted': 0}
+        # Existing objects named after the base name, fetched in parallel
+        self.existing = {}
+        for type, path in (('schedule', 'schedules'),
+                           ('escalation_policy', 'escalation_policies')):
+            self.existing[type] = [
+                item for item in pd_rest.get_all(
+                    '/{path}'.format(path=path),
+                    path,
+                    {'query': base_name},
+                    workers
+                )
+                if item['name'] == base_name or
+                item['name'].startswith(base_name + ' ')
+            ]
+
+    def create_schedule(self, payload):
+        """Create, update or reuse a schedule"""
+
+        return {'schedule': {'id': self.reconcile('schedule', payload)}}
+
+    def create_escalation_policy(self, payload):
+        """Create, update or reuse an escalation policy"""
+
+        return {
+            'escalation_policy': {
+                'id': self.reconcile('escalation_policy', payload)
+            }
+        }
+
+    def reconcile(self, type, payload):
+        """Send only the call needed to make PagerDuty match a payload and
+        return the ID of the object
+        """
+
+        description = self.get_description(self.get_fingerprint(payload))
+        body = dict(payload.get(type, payload))
+        body['description'] = description
+        with self.lock:
+            match = self.get_match(type, body['name'], description)
+            if match:
+                self.used.add(match['id'])
+        # Keep the payload wrapped in its type key only if it was before
+        if type in payload:
+            body = {type: body}
+        if match is None:
+            if type == 'schedule':
+                res = self.pd_rest.create_schedule(body)
+            else:
+                res = self.pd_rest.create_escalation_policy(body)
+            object_id = res[type]['id']
+            count = 'created'
+        elif match.get('description') == description:
+            object_id = match['id']
+            count = 'unchanged'
+        else:
+            if type == 'schedule':
+                self.pd_rest.update_schedule(match['id'], body)
+            else:
+                self.pd_rest.update_escalation_policy(match['id'], body)
+            object_id = match['id']
+            count = 'updated'
+        with self.lock:
+            self.used.add(object_id)
+            self.counts[count] += 1
+        return object_id
+
+    def finish(self):
+        """Delete managed objects of this base name that the import no
+        longer produced and return the number of each call made
+        """
+
+        # Escalation policies go first so no schedule is still in use
+        for item in self.existing['escalation_policy']:
+            if self.is_stale(item):
+                self.pd_rest.delete_escalation_policy(item['id'])
+                self.counts['deleted'] += 1
+        for item in self.existing['schedule']:
+            if self.is_stale(item):
+                self.pd_rest.delete_schedule(item['id'])
+                self.counts['deleted'] += 1
+        print ('Reconciled {base_name}: {created} created, {updated} '
+               'updated, {unchanged} unchanged, {deleted} deleted'.format(
+                    base_name=self.base_name,
+                    **self.counts
+               ))
+        return self.counts
+
+    # HELPER FUNCTIONS
+    def get_fingerprint(self, payload):
+        """Helper function to hash the canonical JSON of a payload"""
+
+        return hashlib.sha1(
+            json.dumps(payload, sort_keys=True, separators=(',', ':'))
+        ).hexdigest()
+
+    def get_description(self, fingerprint):
+        """Helper function to get the description marking an object as
+        managed by this import
+        """
+
+        return '{prefix}{fingerprint}{owner}{base_name}'.format(
+            prefix=FINGERPRINT_PREFIX,
+            fingerprint=fingerprint,
+            owner=FINGERPRINT_OWNER,
+            base_name=self.base_name
+        )
+
+    def get_owner(self, item):
+        """Helper function to get the base name of the import that manages an
+        existing object, or None if reconcile mode does not manage it
+        """
+
+        description = item.get('description') or ''
+        if (not description.startswith(FINGERPRINT_PREFIX) or
+                FINGERPRINT_OWNER not in description):
+            return None
+        return description.split(FINGERPRINT_OWNER, 1)[1]
+
+    def get_match(self, type, name, description):
+        """Helper function to pick the unused existing object to reconcile
+        with, preferring one with the same fingerprint, then one managed by
+        this import. Objects managed by other imports are never picked.
+        """
+
+        matches = [item for item in self.existing[type]
+                   if item['name'] == name and item['id'] not in self.used and
+                   self.get_owner(item) in (None, self.base_name)]
+        for item in matches:
+            if item.get('description') == description:
+                return item
+        for item in matches:
+            if self.get_owner(item) == self.base_name:
+                return item
+        return matches[0] if matches else None
+
+    def is_stale(self, item):
+        """Helper function to check if an existing object is managed by
+        this import's base name and was not produced by this run
+        """
+
+        return (item['id'] not in self.used and
+                self.get_owner(item) == self.base_name)
+
+
+class TransactionREST(DelegatingREST):
+    """Class to wrap PagerDutyREST so that every schedule and escalation
+    policy created through it can be deleted again if the import fails
+    """
+
+    def __init__(self, pd_rest):
+        DelegatingREST.__init__(self, pd_rest)
+        self.created = []
+        self.lock = threading.Lock()
+
+    def create_schedule(self, payload):
+        """Create a schedule and track it for rollback"""
+
+        res = self.pd_rest.create_schedule(payload)
+        with self.lock:
+            self.created.append(('schedule', res['schedule']['id']))
+        return res
+
+    def create_escalation_policy(self, payload):
+        """Create an escalation policy and track it for rollback"""
+
+        res = self.pd_rest.create_escalation_policy(payload)
+        with self.lock:
+            self.created.append(
+                ('escalation_policy', res['escalation_policy']['id'])
+            )
+        return res
+
+    def rollback(self, workers=4):
+        """Delete every tracked object concurrently, escalation policies
+        before the schedules they reference, and return the ones that
+        could not be deleted
+        """
+
+        with self.lock:
+            created, self.created = self.created, []
+
+        def delete(item):
+            type, object_id = item
+            try:
+                if type == 'schedule':
+                    self.pd_rest.delete_schedule(object_id)
+                else:
+                    self.pd_rest.delete_escalation_policy(object_id)
+            except Exception as e:
+                return {
+                    'type': type,
+                    'id': object_id,
+                    'error': '{error}'.format(error=e)
+                }
+
+        failed = []
+        for type in ('escalation_policy', 'schedule'):
+            items = [item for item in created if item[0] == type]
+            if not items:
+                continue
+            pool = ThreadPool(max(1, min(workers, len(items))))
+            try:
+                failed.extend(result for result in pool.map(delete, items)
+                              if result)
+            finally:
+                pool.close()
+        print "Rolled back {deleted} of {total} created objects".format(
+            deleted=len(created) - len(failed),
+            total=len(created)
+        )
+        for result in failed:
+            print "Could not delete {type} {id}: {error}".format(**result)
+        return failed
+
+
+class Journal():
+    """Class to append each completed piece of an import to a local JSONL
+    file, keyed by the SHA-1 of the CSV content, so a rerun can resume
+    where a failed import stopped
+    """
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.entries = {}
+        self.lock = threading.Lock()
+        if resume and os.path.exists(filename):
+            with open(filename) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line may be cut short by a crash
+                        continue
+                    self.entries[(entry['file'], entry['stage'],
+                                  entry['key'])] = entry['id']
+        self.output = open(filename, 'a' if resume else 'w')
+
+    def get(self, file_key, stage, key):
+        """Get the ID recorded for a stage, or None if it is not done"""
+
+        with self.lock:
+            return self.entries.get((file_key, stage, key))
+
+    def record(self, file_key, stage, key, object_id):
+        """Append a completed stage and flush it to disk right away"""
+
+        with self.lock:
+            self.entries[(file_key, stage, key)] = object_id
+            self.output.write(json.dumps({
+                'file': file_key,
+                'stage': stage,
+                'key': key,
+                'id': object_id,
+                'time': time.time()
+            }, sort_keys=True) + '\n')
+            self.output.flush()
+            os.fsync(self.output.fileno())
+
+    def forget(self, object_ids):
+        """Record that objects no longer exist so a resume creates them
+        again
+        """
+
+        object_ids = set(object_ids)
+        with self.lock:
+            keys = [key for key, object_id in self.entries.items()
+                    if object_id in object_ids]
+        for key in keys:
+            self.record(key[0], key[1], key[2], None)
+
+    def close(self):
+        """Close the journal file"""
+
+        self.output.close()
+
+    # HELPER FUNCTIONS
+    def get_file_key(self, filename):
+        """Helper function to hash the content of a CSV file"""
+
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+
+class JournalREST(DelegatingREST):
+    """Class to wrap PagerDutyREST so that each schedule and escalation
+    policy created for a CSV file is recorded in a Journal, and one already
+    recorded is not created again
+    """
+
+    def __init__(self, pd_rest, journal, file_key):
+        DelegatingREST.__init__(self, pd_rest)
+        self.journal = journal
+        self.file_key = file_key
+
+    def create_schedule(self, payload):
+        """Create a schedule unless the journal already has it"""
+
+        return {'schedule': {'id': self.create('schedule', payload)}}
+
+    def create_escalation_policy(self, payload):
+        """Create an escalation policy unless the journal already has it"""
+
+        return {
+            'escalation_policy': {
+                'id': self.create('escalation_policy', payload)
+            }
+        }
+
+    def create(self, type, payload):
+        """Get the recorded ID of an object by name or create and record
+        it
+        """
+
+        name = payload.get(type, payload)['name']
+        object_id = self.journal.get(self.file_key, type, name)
+        if object_id:
+            return object_id
+        if type == 'schedule':
+            res = self.pd_rest.create_schedule(payload)
+        else:
+            res = self.pd_rest.create_escalation_policy(payload)
+        self.journal.record(self.file_key, type, name, res[type]['id'])
+        return res[type]['id']
+
+
 # WEEKLY SHIFT FUNCTIONS ##################################################
+class ShiftEntry(object):
+    """Class to hold one row of a weekly shift CSV with its days as a
+    bitmask
+    """
+
+    __slots__ = ('escalation_level', 'id', 'type', 'days', 'start_time',
+                 'end_time')
+
+    def __init__(self, escalation_level, id, type, days, start_time,
+                 end_time):
+        self.escalation_level = escalation_level
+        self.id = id
+        self.type = type
+        self.days = days
+        self.start_time = start_time
+        self.end_time = end_time
+
+    def to_dict(self):
+        """Get the entry in the format used by the weekly shift logic"""
+
+        return {
+            'escalation_level': self.escalation_level,
+            'id': self.id,
+            'type': self.type,
+            'start_time': self.start_time,
+            'end_time': self.end_time
+        }
+
+
 class WeeklyShiftLogic():
     """Class to house the weekly shift import logic"""
 
@@ -182,84 +1615,43 @@ class WeeklyShiftLogic():
     def create_days_of_week(self, file):
         """Parse CSV file into days of week"""
 
-        sunday_entries = []
-        monday_entries = []
-        tuesday_entries = []
-        wednesday_entries = []
-        thursday_entries = []
-        friday_entries = []
-        saturday_entries = []
-        reader = csv.DictReader(open(file), fieldnames=('escalation_level',
-                                                        'user_or_team',
-                                                        'type',
-                                                        'day_of_week',
-                                                        'start_time',
-                                                        'end_time'))
-        reader.next()
-        for row in reader:
-            entry = {
-                'escalation_level': int(row['escalation_level']),
-                'id': row['user_or_team'],
-                'type': row['type'],
-                'start_time': row['start_time'],
-                'end_time': row['end_time']
-            }
-            if (row['day_of_week'] == 0 or
-                    row['day_of_week'].lower() == 'sunday'):
-                sunday_entries.append(entry)
-            elif (row['day_of_week'] == 1 or
-                    row['day_of_week'].lower() == 'monday'):
-                monday_entries.append(entry)
-            elif (row['day_of_week'] == 2 or
-                  row['day_of_week'].lower() == 'tuesday'):
-                tuesday_entries.append(entry)
-            elif (row['day_of_week'] == 3 or
-                  row['day_of_week'].lower() == 'wednesday'):
-                wednesday_entries.append(entry)
-            elif (row['day_of_week'] == 4 or
-                  row['day_of_week'].lower() == 'thursday'):
-                thursday_entries.append(entry)
-            elif (row['day_of_week'] == 5 or
-                    row['day_of_week'].lower() == 'friday'):
-                friday_entries.append(entry)
-            elif (row['day_of_week'] == 6 or
-                  row['day_of_week'].lower() == 'saturday'):
-                saturday_entries.append(entry)
-            elif (row['day_of_week'] == 'weekday' or
-                  row['day_of_week'] == 'weekdays'):
-                monday_entries.append(entry)
-                tuesday_entries.append(entry)
-                wednesday_entries.append(entry)
-                thursday_entries.append(entry)
-                friday_entries.append(entry)
-            elif (row['day_of_week'] == 'weekend' or
-                  row['day_of_week'] == 'weekends'):
-                saturday_entries.append(entry)
-                sunday_entries.append(entry)
-            elif row['day_of_week'] == 'all':
-                monday_entries.append(entry)
-                tuesday_entries.append(entry)
-                wednesday_entries.append(entry)
-                thursday_entries.append(entry)
-                friday_entries.append(entry)
-                saturday_entries.append(entry)
-                sunday_entries.append(entry)
-            else:
-                print ('Error: Entry {name} has an unknown value for '
-                       'day_of_week: {day}'.format(
-                            name=row['user_or_team'],
-                            day=row['day_of_week']
-                        )
-                       )
-        # Create days with entries
-        sunday = {'day_of_week': 0, 'entries': sunday_entries}
-        monday = {'day_of_week': 1, 'entries': monday_entries}
-        tuesday = {'day_of_week': 2, 'entries': tuesday_entries}
-        wednesday = {'day_of_week': 3, 'entries': wednesday_entries}
-        thursday = {'day_of_week': 4, 'entries': thursday_entries}
-        friday = {'day_of_week': 5, 'entries': friday_entries}
-        saturday = {'day_of_week': 6, 'entries': saturday_entries}
-        return [sunday, monday, tuesday, wednesday, thursday, friday, saturday]
+        days = [{'day_of_week': i, 'entries': []} for i in range(7)]
+        entries = [day['entries'] for day in days]
+        for entry in self.iter_entries(file):
+            entry_dict = entry.to_dict()
+            for i in DAY_OF_WEEK_INDEXES[entry.days]:
+                entries[i].append(entry_dict)
+        return days
+
+    def iter_entries(self, file):
+        """Stream the rows of a CSV file as ShiftEntry records"""
+
+        with open(file) as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                # Skip blank lines like DictReader does
+                if not row:
+                    continue
+                (escalation_level, user_or_team, type, day_of_week,
+                 start_time, end_time) = row[:6]
+                days = DAY_OF_WEEK_MASKS.get(day_of_week.strip().lower())
+                if days is None:
+                    print ('Error: Entry {name} has an unknown value for '
+                           'day_of_week: {day}'.format(
+                                name=user_or_team,
+                                day=day_of_week
+                            )
+                           )
+                    continue
+                yield ShiftEntry(
+                    int(escalation_level),
+                    user_or_team,
+                    type,
+                    days,
+                    start_time,
+                    end_time
+                )
 
     def split_teams_into_users(self, pd_rest, days):
         """Split teams into multiple user entries"""
@@ -267,14 +1659,15 @@ class WeeklyShiftLogic():
         output = []
         for i, day in enumerate(days):
             output.append({'day_of_week': i, 'entries': []})
-            total_entries = 0
+            targets = {}
             for j, entry in enumerate(day['entries']):
+                added = 0
                 if entry['type'].lower() == 'team':
-                    users = pd_rest.get_users_in_team(pd_rest.get_team_id(
+                    users = pd_rest.iter_users_in_team(pd_rest.get_team_id(
                         entry['id'])
                     )
                     for user in users:
-                        total_entries += 1
+                        added += 1
                         output[i]['entries'].append({
                             'escalation_level': entry['escalation_level'],
                             'id': user['email'],
@@ -283,13 +1676,16 @@ class WeeklyShiftLogic():
                             'end_time': entry['end_time']
                         })
                 elif entry['type'].lower() == 'user':
-                    total_entries += 1
+                    added += 1
                     output[i]['entries'].append(entry)
                 else:
                     raise ValueError('Type must be of user or team')
-                if total_entries > 25:
-                    raise ValueError('Can only have a maximum of 25 targets '
-                                     'per escalation policy level')
+                level = entry['escalation_level']
+                targets[level] = targets.get(level, 0) + added
+                if targets[level] > MAX_LEVEL_TARGETS:
+                    raise ValueError('Can only have a maximum of {max} '
+                                     'targets per escalation policy level'
+                                     .format(max=MAX_LEVEL_TARGETS))
         return output
 
     def get_user_ids(self, pd_rest, days):
@@ -345,269 +1741,444 @@ class WeeklyShiftLogic():
             })
         return ep_by_level
 
+    def stream_levels(self, pd_rest, file, counts=None):
+        """Stream a CSV file through parsing, team expansion and ID
+        resolution into the per-level structure of split_days_by_level
+        without building each intermediate stage. Pass a dict as counts to
+        get the number of CSV rows and of user entries after expansion.
+        """
+
+        if counts is None:
+            counts = {}
+        entries = self.count_entries(self.iter_entries(file), counts, 'rows')
+        entries = self.expand_teams(pd_rest, entries)
+        entries = self.count_entries(entries, counts, 'entries')
+        entries = self.resolve_user_ids(pd_rest, entries)
+        return self.bucket_by_level(entries)
+
+    def count_entries(self, entries, counts, key):
+        """Stream entries unchanged, counting them in counts[key]"""
+
+        counts[key] = 0
+        for entry in entries:
+            counts[key] += 1
+            yield entry
+
+    def expand_teams(self, pd_rest, entries):
+        """Stream entries with each team replaced by an entry per user"""
+
+        targets = {}
+        for entry in entries:
+            if entry.type.lower() == 'team':
+                users = pd_rest.iter_users_in_team(
+                    pd_rest.get_team_id(entry.id)
+                )
+                expanded = (ShiftEntry(
+                    entry.escalation_level,
+                    user['email'],
+                    'user',
+                    entry.days,
+                    entry.start_time,
+                    entry.end_time
+                ) for user in users)
+            elif entry.type.lower() == 'user':
+                expanded = (entry,)
+            else:
+                raise ValueError('Type must be of user or team')
+            for user_entry in expanded:
+                for i in DAY_OF_WEEK_INDEXES[user_entry.days]:
+                    key = (user_entry.escalation_level, i)
+                    targets[key] = targets.get(key, 0) + 1
+                    if targets[key] > MAX_LEVEL_TARGETS:
+                        raise ValueError('Can only have a maximum of {max} '
+                                         'targets per escalation policy '
+                                         'level'.format(
+                                            max=MAX_LEVEL_TARGETS
+                                         ))
+                yield user_entry
+
+    def resolve_user_ids(self, pd_rest, entries):
+        """Stream entries with user names and emails replaced by user IDs"""
+
+        for entry in entries:
+            entry.id = pd_rest.get_user_id(entry.id)
+            yield entry
+
+    def bucket_by_level(self, entries):
+        """Collect entries into days by escalation level"""
+
+        levels = {}
+        for entry in entries:
+            if entry.escalation_level not in levels:
+                levels[entry.escalation_level] = [[] for i in range(7)]
+            days = levels[entry.escalation_level]
+            entry_dict = entry.to_dict()
+            for i in DAY_OF_WEEK_INDEXES[entry.days]:
+                days[i].append(entry_dict)
+        return [{
+            'schedules': [{
+                'name': '{base_name} {level_name} {level}'.format(
+                    base_name=self.base_name,
+                    level_name=self.level_name,
+                    level=level
+                ),
+                'days': levels[level]
+            }]
+        } for level in sorted(levels)]
+
     def get_time_periods(self, ep_by_level):
-        """Breaks out each day by time period"""
+        """Breaks out each day into the elementary time periods between shift
+        boundaries along with the entries covering each period
+        """
 
         for level in ep_by_level:
             for i, day in enumerate(level['schedules'][0]['days']):
-                time_periods = []
-                for entry in day:
-                    # Loop through current time_periods to check for overlaps
-                    if len(time_periods) > 0:
-                        overlap = False
-                        for period in time_periods:
-                            # TODO: Handle cases where times overlap but are not exactly the same start & end # NOQA
-                            if (entry['start_time'] == period['start_time'] and
-                               entry['end_time'] == period['end_time']):
-                                period['entries'].append({
-                                    'id': entry['id'],
-                                    'type': entry['type']
-                                })
-                                overlap = True
-                                break
-                        if not overlap:
-                            time_periods.append({
-                                'start_time': entry['start_time'],
-                                'end_time': entry['end_time'],
-                                'entries': [{
-                                    'id': entry['id'],
-                                    'type': entry['type']
-                                }]
-                            })
-                    else:
-                        time_periods.append({
-                            'start_time': entry['start_time'],
-                            'end_time': entry['end_time'],
-                            'entries': [{
-                                'id': entry['id'],
-                                'type': entry['type']
-                            }]
-                        })
                 level['schedules'][0]['days'][i] = {
-                    "time_periods": time_periods
+                    'time_periods': self.sweep_time_periods(day)
                 }
         return ep_by_level
 
+    def sweep_time_periods(self, entries):
+        """Sweep the boundaries of a day's entries in order and emit each
+        period between two boundaries that has at least one entry on-call
+        """
+
+        events = []
+        labels = {}
+        for index, entry in enumerate(entries):
+            start = self.get_seconds(entry['start_time'])
+            end = self.get_seconds(entry['end_time'])
+            if end == 0:
+                # A shift ending at 0:00 runs until the end of the day
+                end = 86400
+                labels.setdefault(end, self.get_time_string(end))
+            if end <= start:
+                raise ValueError('Invalid input. end_time must come after '
+                                 'start_time. You input: {start} - {end}'
+                                 .format(start=entry['start_time'],
+                                         end=entry['end_time']))
+            labels.setdefault(start, entry['start_time'])
+            labels.setdefault(end, entry['end_time'])
+            # Ends sort before starts so touching shifts do not overlap
+            events.append((start, 1, index))
+            events.append((end, 0, index))
+        events.sort()
+        time_periods = []
+        active = set()
+        previous = None
+        for seconds, is_start, index in events:
+            if active and seconds != previous:
+                time_periods.append({
+                    'start_time': labels[previous],
+                    'end_time': labels[seconds],
+                    'entries': [{
+                        'id': entries[j]['id'],
+                        'type': entries[j]['type']
+                    } for j in sorted(active)]
+                })
+            if is_start:
+                active.add(index)
+            else:
+                active.discard(index)
+            previous = seconds
+        return time_periods
+
     def check_for_overlap(self, ep_by_level):
-        """Checks time periods for multiple entries and breaks the entries into
-        multiple schedules
+        """Checks time periods for multiple entries and packs the entries into
+        the fewest schedules that never overlap
         """
 
         output = []
-        for i, level in enumerate(ep_by_level):
-            output.append({
-                'schedules': [
-                    {
-                        'name': level['schedules'][0]['name'],
-                        'days': []
-                    }
-                ]
-            })
-            new_base_name = level['schedules'][0]['name']
-            for j, day in enumerate(level['schedules'][0]['days']):
-                output[i]['schedules'][0]['days'].append({'time_periods': []})
-                if len(day['time_periods']) == 0:
-                    continue
-                for k, period in enumerate(day['time_periods']):
-                    if len(period['entries']) > 1:
-                        for l, entry in enumerate(period['entries']):
-                            try:
-                                output[i]['schedules'][l]['name'] = (
-                                    '{base_name} {multi_name} {multiple}'
-                                    .format(
-                                        base_name=new_base_name,
-                                        multi_name=self.multi_name,
-                                        multiple=l + 1
-                                    )
-                                )
-                                (output[i]['schedules'][l]['days'][j]
-                                    ['time_periods']).append({
-                                        'start_time': period['start_time'],
-                                        'end_time': period['end_time'],
-                                        'id': entry['id'],
-                                        'type': entry['type']
-                                    })
-                            except IndexError:
-                                output[i]['schedules'].insert(
-                                    l,
-                                    {
-                                        'name': ('{base_name} {multi_name} '
-                                                 '{multiple}').format(
-                                            base_name=new_base_name,
-                                            multi_name=self.multi_name,
-                                            multiple=l + 1
-                                        ),
-                                        'days': [
-                                            {'time_periods': []},
-                                            {'time_periods': []},
-                                            {'time_periods': []},
-                                            {'time_periods': []},
-                                            {'time_periods': []},
-                                            {'time_periods': []},
-                                            {'time_periods': []}
-                                        ]
-                                    }
-                                )
-                                (output[i]['schedules'][l]['days'][j]
-                                    ['time_periods']).append({
-                                        'start_time': period['start_time'],
-                                        'end_time': period['end_time'],
-                                        'id': entry['id'],
-                                        'type': entry['type']
-                                    })
-                    else:
-                        (output[i]['schedules'][0]['days'][j]
-                            ['time_periods']).append({
-                                'start_time': period['start_time'],
-                                'end_time': period['end_time'],
-                                'id': period['entries'][0]['id'],
-                                'type': period['entries'][0]['type']
-                            })
+        for level in ep_by_level:
+            base_name = level['schedules'][0]['name']
+            intervals = self.get_entry_intervals(level['schedules'][0]['days'])
+            num_schedules = self.assign_schedules(intervals)
+            schedules = []
+            for k in range(max(num_schedules, 1)):
+                if num_schedules > 1:
+                    name = '{base_name} {multi_name} {multiple}'.format(
+                        base_name=base_name,
+                        multi_name=self.multi_name,
+                        multiple=k + 1
+                    )
+                else:
+                    name = base_name
+                schedules.append({
+                    'name': name,
+                    'days': [{'time_periods': []} for day in range(7)]
+                })
+            for interval in intervals:
+                (schedules[interval['schedule']]['days'][interval['day']]
+                 ['time_periods']).append({
+                    'start_time': interval['start_time'],
+                    'end_time': interval['end_time'],
+                    'id': interval['id'],
+                    'type': interval['type']
+                 })
+            output.append({'schedules': schedules})
         return output
 
+    def get_entry_intervals(self, days):
+        """Join the consecutive time periods each entry covers within a day
+        into intervals sorted by day and start time
+        """
+
+        intervals = []
+        for j, day in enumerate(days):
+            periods = sorted(
+                day['time_periods'],
+                key=lambda period: self.get_seconds(period['start_time'])
+            )
+            # Intervals of each entry that are still open for extension
+            open_intervals = {}
+            for period in periods:
+                start = self.get_seconds(period['start_time'])
+                end = self.get_seconds(period['end_time']) or 86400
+                extended = set()
+                for entry in period['entries']:
+                    interval = None
+                    for candidate in open_intervals.get(entry['id'], []):
+                        if (candidate['end'] == start and
+                                id(candidate) not in extended):
+                            interval = candidate
+                            break
+                    if interval is None:
+                        interval = {
+                            'day': j,
+                            'start': start,
+                            'start_time': period['start_time'],
+                            'id': entry['id'],
+                            'type': entry['type']
+                        }
+                        intervals.append(interval)
+                        open_intervals.setdefault(entry['id'], []).append(
+                            interval
+                        )
+                    interval['end'] = end
+                    interval['end_time'] = period['end_time']
+                    extended.add(id(interval))
+        # sort is stable so ties keep the order entries were listed in
+        intervals.sort(key=lambda interval: (interval['day'],
+                                             interval['start']))
+        return intervals
+
+    def assign_schedules(self, intervals):
+        """Assign each interval a schedule by greedy interval partitioning,
+        preferring the schedule the same entry was last on. Returns the
+        number of schedules used, which is the minimum possible.
+        """
+
+        busy = []
+        free = []
+        free_set = set()
+        last_schedule = {}
+        num_schedules = 0
+        for interval in intervals:
+            start = interval['day'] * 86400 + interval['start']
+            while busy and busy[0][0] <= start:
+                schedule = heapq.heappop(busy)[1]
+                heapq.heappush(free, schedule)
+                free_set.add(schedule)
+            schedule = last_schedule.get(interval['id'])
+            if schedule not in free_set:
+                # Drop heap entries for schedules taken out of turn
+                while free and free[0] not in free_set:
+                    heapq.heappop(free)
+                if free:
+                    schedule = heapq.heappop(free)
+                else:
+                    schedule = num_schedules
+                    num_schedules += 1
+            free_set.discard(schedule)
+            interval['schedule'] = schedule
+            last_schedule[interval['id']] = schedule
+            heapq.heappush(
+                busy,
+                (interval['day'] * 86400 + interval['end'], schedule)
+            )
+        return num_schedules
+
     def concat_time_periods(self, schedule):
         """Concatenate any time periods that cross multiple days together"""
 
         output = {'name': schedule['name'], 'time_periods': []}
-        for i, day in enumerate(schedule['days']):
+        # Index periods on their normalized times and ID to merge in one pass
+        index = {}
+        for i, period in self.join_midnight_periods(schedule['days']):
+            key = (
+                self.get_seconds(period['start_time']),
+                self.get_seconds(period['end_time']) or 86400,
+                period['id']
+            )
+            if key in index:
+                index[key]['days'].append(i)
+            else:
+                index[key] = {
+                    'start_time': period['start_time'],
+                    'end_time': period['end_time'],
+                    'id': period['id'],
+                    'days': [i]
+                }
+                output['time_periods'].append(index[key])
+        return output
+
+    def join_midnight_periods(self, days):
+        """Join each period ending at midnight with the same entry's period
+        starting at midnight the next day when together they last less than
+        a day. Returns (day, period) pairs in day order.
+        """
+
+        starts = {}
+        for i, day in enumerate(days):
+            for period in day['time_periods']:
+                if self.get_seconds(period['start_time']) == 0:
+                    starts[(i, period['id'])] = period
+        joins = {}
+        joined = set()
+        for i, day in enumerate(days):
+            for period in day['time_periods']:
+                if self.get_seconds(period['end_time']) % 86400:
+                    continue
+                next_period = starts.get(((i + 1) % 7, period['id']))
+                if (next_period is not None and
+                        self.get_seconds(period['start_time']) >
+                        self.get_seconds(next_period['end_time'])):
+                    joins[id(period)] = next_period
+                    joined.add(id(next_period))
+        output = []
+        for i, day in enumerate(days):
             for period in day['time_periods']:
-                foundMatch = False
-                for j, tp in enumerate(output['time_periods']):
-                    if (period['start_time'] == tp['start_time'] and
-                            period['end_time'] == tp['end_time'] and
-                            period['id'] == tp['id']):
-                        output['time_periods'][j]['days'].append(i)
-                        foundMatch = True
-                        break
-                if not foundMatch:
-                    output['time_periods'].append({
+                if id(period) in joined:
+                    continue
+                if id(period) in joins:
+                    period = {
                         'start_time': period['start_time'],
-                        'end_time': period['end_time'],
+                        'end_time': joins[id(period)]['end_time'],
                         'id': period['id'],
-                        'days': [i]
-                    })
+                        'type': period.get('type')
+                    }
+                output.append((i, period))
         return output
 
     def get_schedule_payload(self, schedule):
         # TODO: Handle rotations and rotation lengths or at least don't hard code a random value # NOQA
         # TODO: Handle different date formats
-        start_date = datetime.strptime(self.start_date, '%Y-%m-%d')
-        tz = pytz.timezone(self.time_zone)
-        output = {
-            'schedule': {
-                'name': schedule['name'],
-                'type': 'schedule',
-                'time_zone': self.time_zone,
-                'schedule_layers': []
-            }
+        return self.get_schedule_payloads([schedule])[0]
+
+    def get_schedule_payloads(self, schedules):
+        """Build the payloads for a list of schedules, converting each time
+        and layer boundary only once for the whole batch
+        """
+
+        tz = get_time_zone(self.time_zone)
+        start = get_localized_isoformat(
+            datetime.strptime(self.start_date, '%Y-%m-%d'),
+            tz
+        )
+        layer_template = {
+            'start': start,
+            'rotation_virtual_start': start,
+            'rotation_turn_length_seconds': 3600
         }
-        if not self.end_date:
-            for i, period in enumerate(schedule['time_periods']):
-                output['schedule']['schedule_layers'].append({
-                    'start': tz.localize(start_date).isoformat(),
-                    'rotation_virtual_start': tz.localize(start_date)
-                    .isoformat(),
-                    'rotation_turn_length_seconds': 3600,
-                    'users': [{
-                        'user': {
-                            'id': period['id'],
-                            'type': 'user_reference'
-                        }
-                    }],
-                    'restrictions': []
-                })
-                # Set to daily_restriction if the period exists for all days
-                if len(period['days']) == 7:
-                    (output
-                     ['schedule']['schedule_layers'][i]['restrictions']
-                     ).append({
-                        'type': 'daily_restriction',
-                        'start_time_of_day': time.strftime(
-                            '%H:%M:%S',
-                            time.gmtime(self.get_seconds(period['start_time']))
-                        ),
-                        'duration_seconds': (
-                            self.get_seconds(period['end_time']) -
-                            self.get_seconds(period['start_time'])
+        if self.end_date:
+            layer_template['end'] = get_localized_isoformat(
+                datetime.strptime(self.end_date, '%Y-%m-%d'),
+                tz
+            )
+        seconds = {}
+        times_of_day = {}
+        output = []
+        for schedule in schedules:
+            periods = schedule['time_periods']
+            for period in periods:
+                for time_string in (period['start_time'], period['end_time']):
+                    if time_string not in seconds:
+                        seconds[time_string] = self.get_seconds(time_string)
+            starts = [seconds[period['start_time']] for period in periods]
+            # Periods that end at or before their start run past midnight
+            durations = [
+                (seconds[period['end_time']] - period_start) % 86400 or 86400
+                for period, period_start in zip(periods, starts)
+            ]
+            for period_start in starts:
+                if period_start not in times_of_day:
+                    times_of_day[period_start] = (
+                        '{hours:02d}:{minutes:02d}:{seconds:02d}'.format(
+                            hours=period_start // 3600,
+                            minutes=period_start % 3600 // 60,
+                            seconds=period_start % 60
                         )
-                     })
-                else:
-                    for day in period['days']:
-                        if day == 0:
-                            day = 7
-                        (output
-                         ['schedule']['schedule_layers'][i]['restrictions']
-                         ).append({
-                            'type': 'weekly_restriction',
-                            'start_time_of_day': time.strftime(
-                                '%H:%M:%S',
-                                time.gmtime(self.get_seconds(
-                                    period['start_time']
-                                ))
-                            ),
-                            'duration_seconds': (self.get_seconds(
-                                period['end_time']
-                            ) - self.get_seconds(
-                                period['start_time']
-                            )),
-                            'start_day_of_week': day
-                         })
-        else:
-            for i, period in enumerate(schedule['time_periods']):
-                output['schedule']['schedule_layers'].append({
-                    'start': tz.localize(start_date).isoformat(),
-                    'end': tz.localize(datetime
-                                       .strptime(self.end_date, '%Y-%m-%d')
-                                       ).isoformat(),
-                    'rotation_virtual_start': tz.localize(start_date)
-                    .isoformat(),
-                    'rotation_turn_length_seconds': 3600,
-                    'users': [{
-                        'user': {
-                            'id': period['id'],
-                            'type': 'user_reference'
-                        }
-                    }],
-                    'restrictions': []
-                })
+                    )
+            layers = []
+            for period, period_start, duration in zip(periods, starts,
+                                                      durations):
+                layer = dict(layer_template)
+                layer['users'] = [{
+                    'user': {
+                        'id': period['id'],
+                        'type': 'user_reference'
+                    }
+                }]
                 # Set to daily_restriction if the period exists for all days
                 if len(period['days']) == 7:
-                    (output
-                     ['schedule']['schedule_layers'][i]['restrictions']
-                     ).append({
+                    layer['restrictions'] = [{
                         'type': 'daily_restriction',
-                        'start_time_of_day': time.strftime(
-                            '%H:%M:%S',
-                            time.gmtime(self.get_seconds(period['start_time']))
-                        ),
-                        'duration_seconds': (
-                            self.get_seconds(period['end_time']) -
-                            self.get_seconds(period['start_time'])
-                        )
-                     })
+                        'start_time_of_day': times_of_day[period_start],
+                        'duration_seconds': duration
+                    }]
                 else:
-                    for day in period['days']:
-                        if day == 0:
-                            day = 7
-                        (output
-                         ['schedule']['schedule_layers'][i]['restrictions']
-                         ).append({
-                            'type': 'weekly_restriction',
-                            'start_time_of_day': time.strftime(
-                                '%H:%M:%S',
-                                time.gmtime(
-                                    self.get_seconds(period['start_time'])
-                                )
-                            ),
-                            'duration_seconds': (self.get_seconds(
-                                period['end_time']
-                            ) - self.get_seconds(
-                                period['start_time']
-                            )),
-                            'start_day_of_week': day
-                         })
+                    layer['restrictions'] = [{
+                        'type': 'weekly_restriction',
+                        'start_time_of_day': times_of_day[period_start],
+                        'duration_seconds': duration,
+                        'start_day_of_week': day or 7
+                    } for day in period['days']]
+                layers.append(layer)
+            output.append({
+                'schedule': {
+                    'name': schedule['name'],
+                    'type': 'schedule',
+                    'time_zone': self.time_zone,
+                    'schedule_layers': layers
+                }
+            })
         return output
 
+    def create_schedules(self, pd_rest, ep_by_level, workers=1, tracer=None):
+        """Create every schedule in the escalation policy concurrently and
+        replace each schedule with its ID
+        """
+
+        tracer = tracer or Tracer(False)
+
+        schedules = []
+        for i, level in enumerate(ep_by_level):
+            for j, schedule in enumerate(level['schedules']):
+                schedules.append((i, j, schedule))
+
+        def create_schedule(item):
+            with tracer.span('concat_time_periods') as span:
+                schedule = self.concat_time_periods(item[2])
+                span.set(level=item[0] + 1, schedule=item[1] + 1)
+            with tracer.span('get_schedule_payload') as span:
+                schedule_payload = self.get_schedule_payload(schedule)
+                span.set(
+                    layers=len(schedule_payload['schedule']['schedule_layers'])
+                )
+            with tracer.span('create_schedule', 'post'):
+                res = pd_rest.create_schedule(schedule_payload)
+            return res['schedule']['id']
+
+        pool = ThreadPool(max(1, min(workers, len(schedules))))
+        try:
+            # map returns the IDs in the same order as the schedules
+            schedule_ids = pool.map(tracer.bind(create_schedule), schedules)
+        finally:
+            pool.close()
+        for (i, j, schedule), schedule_id in zip(schedules, schedule_ids):
+            ep_by_level[i]['schedules'][j] = schedule_id
+        return ep_by_level
+
     def get_escalation_policy_payload(self, ep_by_level):
         if self.num_loops == 0:
             output = {
@@ -643,18 +2214,38 @@ class WeeklyShiftLogic():
         return output
 
     # HELPER FUNCTIONS ########################################################
+    def get_time_string(self, seconds):
+        """Helper function to format seconds since 00:00:00 as HH:MM[:SS]"""
+
+        if seconds % 60:
+            return '{hours}:{minutes:02d}:{seconds:02d}'.format(
+                hours=seconds // 3600,
+                minutes=seconds % 3600 // 60,
+                seconds=seconds % 60
+            )
+        return '{hours}:{minutes:02d}'.format(
+            hours=seconds // 3600,
+            minutes=seconds % 3600 // 60
+        )
+
     def get_seconds(self, time):
-        """Helper function to get the seconds since 00:00:00"""
+        """Helper function to get the seconds since 00:00:00. Rosters repeat
+        the same few times, so each one is parsed only once.
+        """
 
+        if time in SHIFT_SECONDS:
+            return SHIFT_SECONDS[time]
         time_list = time.split(':')
         if len(time_list) == 3:
-            return (int(time_list[0]) * 3600 + int(time_list[1]) * 60 +
-                    int(time_list[2]))
+            seconds = (int(time_list[0]) * 3600 + int(time_list[1]) * 60 +
+                       int(time_list[2]))
         elif len(time_list) == 2:
-            return int(time_list[0]) * 3600 + int(time_list[1]) * 60
+            seconds = int(time_list[0]) * 3600 + int(time_list[1]) * 60
         else:
             raise ValueError('Invalid input. Time must be of format HH:MM:SS '
                              'or HH:MM. You input: {time}'.format(time=time))
+        SHIFT_SECONDS[time] = seconds
+        return seconds
 
 
 # STANDARD ROTATION FUNCTIONS #################################################
@@ -668,40 +2259,19 @@ class StandardRotationLogic():
         self.time_zone = time_zone
 
     def get_restriction_type(self, start_day, end_day):
-        acceptable_days = [
-            0,
-            1,
-            2,
-            3,
-            4,
-            5,
-            6,
-            'monday',
-            'tuesday',
-            'wednesday',
-            'thursday',
-            'friday',
-            'saturday',
-            'sunday'
-        ]
         if not start_day and not end_day:
             return "daily_restriction"
-        elif (start_day in acceptable_days and end_day in acceptable_days):
-            if start_day == end_day:
-                return "daily_restriction"
-            else:
-                return "weekly_restriction"
-        elif (start_day.lower() in acceptable_days
-              and end_day.lower() in acceptable_days):
-            if start_day.lower() == end_day.lower():
-                return "daily_restriction"
-            else:
-                return "weekly_restriction"
-        else:
+        start_weekday = WEEKDAYS.get(self.get_day_key(start_day))
+        end_weekday = WEEKDAYS.get(self.get_day_key(end_day))
+        if start_weekday is None or end_weekday is None:
             raise ValueError('Invalid restrict start or end date provided. '
                              'Dates must be in null, 0, 1, 2, 3, 4, 5, 6, '
                              'monday, tuesday, wednesday, thursday, friday, '
                              'saturday, sunday.')
+        elif start_weekday == end_weekday:
+            return "daily_restriction"
+        else:
+            return "weekly_restriction"
 
     def get_rotation_turn_length(self, rotation_type, shift_length,
                                  shift_type):
@@ -729,12 +2299,12 @@ class StandardRotationLogic():
                           start_date, time_zone):
         """Get the start datetime for the layer"""
 
-        tz = pytz.timezone(time_zone)
+        tz = get_time_zone(time_zone)
         start_date = self.get_datetime(start_date, handoff_time)
         if rotation_type == 'daily':
-            return tz.localize(start_date).isoformat()
+            return get_localized_isoformat(start_date, tz)
         elif rotation_type == 'weekly':
-            weekday = tz.localize(start_date).weekday()
+            weekday = start_date.weekday()
             handoff_weekday = self.get_weekday(handoff_day)
             return self.start_date_timedelta(
                 handoff_weekday,
@@ -744,16 +2314,16 @@ class StandardRotationLogic():
             )
         elif rotation_type == 'custom':
             if not handoff_day:
-                return tz.localize(start_date).isoformat()
+                return get_localized_isoformat(start_date, tz)
             else:
                 # TODO: Write tests for handoff_day in incorrect format
                 if datetime.strptime(handoff_day, '%Y-%m-%d') < start_date:
                     raise ValueError('handoff_day must come after start_date.')
                 else:
-                    return tz.localize(self.get_datetime(
-                        handoff_day,
-                        handoff_time
-                    )).isoformat()
+                    return get_localized_isoformat(
+                        self.get_datetime(handoff_day, handoff_time),
+                        tz
+                    )
         else:
             raise ValueError('Invalid rotation_type provided. Must be one of '
                              'daily, weekly, custom.')
@@ -763,98 +2333,49 @@ class StandardRotationLogic():
         """Get the restriction duration in seconds"""
 
         if type == 'daily_restriction':
-            start_datetime = self.get_datetime(
-                date(
-                    datetime.now().year,
-                    datetime.now().month,
-                    datetime.now().day
-                ),
-                start_time
-            )
-            end_datetime = self.get_datetime(
-                date(
-                    datetime.now().year,
-                    datetime.now().month,
-                    datetime.now().day
-                ),
-                end_time
-            )
-            if start_datetime < end_datetime:
-                return int((end_datetime - start_datetime).total_seconds())
-            elif start_datetime > end_datetime:
-                end_datetime += timedelta(days=1)
-                return int((end_datetime - start_datetime).total_seconds())
-            else:
+            duration = (self.get_time_seconds(end_time) -
+                        self.get_time_seconds(start_time)) % 86400
+            if not duration:
                 raise ValueError('Invalid input provided. The restriction '
                                  'start and end datetimes are equal.')
-        else:
-            start_weekday = self.get_weekday(start_day)
-            end_weekday = self.get_weekday(end_day)
-            if start_weekday < end_weekday:
-                start_datetime = self.get_datetime(
-                    date(
-                        datetime.now().year,
-                        datetime.now().month,
-                        datetime.now().day
-                    ),
-                    start_time
-                )
-                end_datetime = self.get_datetime(
-                    date(
-                        datetime.now().year,
-                        datetime.now().month,
-                        datetime.now().day
-                    ) + timedelta(
-                        days=end_weekday - start_weekday
-                    ),
-                    end_time
-                )
-                return int((end_datetime - start_datetime).total_seconds())
-            elif start_weekday > end_weekday:
-                start_datetime = self.get_datetime(
-                    date(
-                        datetime.now().year,
-                        datetime.now().month,
-                        datetime.now().day
-                    ),
-                    start_time
-                )
-                end_datetime = self.get_datetime(
-                    date(
-                        datetime.now().year,
-                        datetime.now().month,
-                        datetime.now().day
-                    ) + timedelta(
-                        days=7 - start_weekday + end_weekday
-                    ),
-                    end_time
-                )
-                return int((end_datetime - start_datetime).total_seconds())
-            else:
-                raise ValueError('Invalid input provided. The restriction '
-                                 'start and end datetimes are equal')
+            return duration
+        start_weekday = self.get_weekday(start_day)
+        end_weekday = self.get_weekday(end_day)
+        if start_weekday == end_weekday:
+            raise ValueError('Invalid input provided. The restriction '
+                             'start and end datetimes are equal')
+        return (((end_weekday - start_weekday) % 7) * 86400 +
+                self.get_time_seconds(end_time) -
+                self.get_time_seconds(start_time))
+
+    def get_restriction_durations(self, restrictions):
+        """Get the durations in seconds of a list of (type, start_day,
+        start_time, end_day, end_time) restrictions
+        """
+
+        return [self.get_restriction_duration(*restriction)
+                for restriction in restrictions]
 
     def parse_csv(self, file):
         """Parse CSV file into layer-by-user based dictionary"""
 
-        reader = csv.DictReader(open(file), fieldnames=(
-            'user',
-            'layer',
-            'layer_name',
-            'rotation_type',
-            'shift_length',
-            'shift_type',
-            'handoff_day',
-            'handoff_time',
-            'restriction_start_day',
-            'restriction_start_time',
-            'restriction_end_day',
-            'restriction_end_time'
-        ))
-        reader.next()
+        with open(file) as csv_file:
+            rows = list(csv.DictReader(csv_file, fieldnames=(
+                'user',
+                'layer',
+                'layer_name',
+                'rotation_type',
+                'shift_length',
+                'shift_type',
+                'handoff_day',
+                'handoff_time',
+                'restriction_start_day',
+                'restriction_start_time',
+                'restriction_end_day',
+                'restriction_end_time'
+            )))[1:]
         layers = {}
-        levels = []
-        for row in reader:
+        for row in rows:
             shift_length = self.nullify(row['shift_length'])
             shift_type = self.nullify(row['shift_type'])
             handoff_day = self.nullify(row['handoff_day'])
@@ -864,8 +2385,7 @@ class StandardRotationLogic():
             )
             restriction_end_day = self.nullify(row['restriction_end_day'])
             restriction_end_time = self.nullify(row['restriction_end_time'])
-            if row['layer'] not in levels:
-                levels.append(row['layer'])
+            if row['layer'] not in layers:
                 layers[row['layer']] = [{
                     'user': row['user'],
                     'layer_name': row['layer_name'],
@@ -944,14 +2464,22 @@ class StandardRotationLogic():
         """
 
         output = []
-        tz = pytz.timezone(self.time_zone)
+        tz = get_time_zone(self.time_zone)
         # TODO: Allow for start/end times, handoff_time?
-        start_datetime = self.get_datetime(self.start_date[0], "00:00:00")
+        start = get_localized_isoformat(
+            self.get_datetime(self.start_date[0], "00:00:00"),
+            tz
+        )
+        if self.end_date[0]:
+            end = get_localized_isoformat(
+                self.get_datetime(self.end_date[0], "00:00:00"),
+                tz
+            )
         layer_index = 0
         for i, level in enumerate(layers):
             output.append({
                 'name': layers[str(layer_index + 1)][0]['layer_name'],
-                'start': tz.localize(start_datetime).isoformat(),
+                'start': start,
                 'rotation_virtual_start': self.get_virtual_start(
                     layers[str(layer_index + 1)][0]['rotation_type'],
                     layers[str(layer_index + 1)][0]['handoff_day'],
@@ -992,8 +2520,7 @@ class StandardRotationLogic():
             })
             # Add end_date if applicable
             if self.end_date[0]:
-                end_datetime = self.get_datetime(self.end_date[0], "00:00:00")
-                output[i]['end'] = tz.localize(end_datetime).isoformat()
+                output[i]['end'] = end
             for user in layers[str(layer_index + 1)]:
                 output[layer_index]['users'].append({
                     'user': {
@@ -1020,81 +2547,63 @@ class StandardRotationLogic():
     def get_datetime(self, date, time):
         """Helper function to parse multiple datetime formats"""
 
-        date_time = "{date}T{time}".format(
-            date=date,
-            time=time
+        date = '{date}'.format(date=date)
+        if date not in PARSED_DATES:
+            PARSED_DATES[date] = datetime.strptime(date, '%Y-%m-%d')
+        return PARSED_DATES[date] + timedelta(
+            seconds=self.get_time_seconds(time)
         )
-        # Handle different time formats
-        if len(time.split(':')) == 3:
-            output = datetime.strptime(
-                date_time,
-                '%Y-%m-%dT%H:%M:%S'
-            )
-        elif len(time.split(':')) == 2:
-            output = datetime.strptime(
-                date_time,
-                '%Y-%m-%dT%H:%M'
-            )
-        else:
+
+    def get_time_seconds(self, time):
+        """Helper function to get the seconds since 00:00:00 from a time in
+        HH:MM or HH:MM:SS format
+        """
+
+        if time in TIME_OF_DAY_SECONDS:
+            return TIME_OF_DAY_SECONDS[time]
+        time_list = time.split(':')
+        if (len(time_list) not in (2, 3) or
+                not all(part.isdigit() and len(part) <= 2
+                        for part in time_list)):
             raise ValueError('Invalid handoff_time. Format must be in HH:MM or'
                              ' HH:MM:SS.')
-        return output
+        time_list = [int(part) for part in time_list] + [0]
+        if time_list[0] > 23 or time_list[1] > 59 or time_list[2] > 61:
+            raise ValueError('Invalid handoff_time. Format must be in HH:MM or'
+                             ' HH:MM:SS.')
+        seconds = time_list[0] * 3600 + time_list[1] * 60 + time_list[2]
+        TIME_OF_DAY_SECONDS[time] = seconds
+        return seconds
 
     def start_date_timedelta(self, handoff_day, weekday, start_date, tz):
         """Helper function to add timedelta to virtual start date"""
 
         if weekday < handoff_day:
             start_date += timedelta(days=(handoff_day - weekday))
-            return tz.localize(start_date).isoformat()
+            return get_localized_isoformat(start_date, tz)
         elif weekday == handoff_day:
-            return tz.localize(start_date).isoformat()
+            return get_localized_isoformat(start_date, tz)
         else:
             start_date += timedelta(days=(7 + handoff_day - weekday))
-            return tz.localize(start_date).isoformat()
+            return get_localized_isoformat(start_date, tz)
 
     def get_weekday(self, weekday):
         """Helper function to convert CSV day into Python datetime weekday"""
 
-        if type(weekday) is int:
-            if weekday == 1:
-                return 0
-            elif weekday == 2:
-                return 1
-            elif weekday == 3:
-                return 2
-            elif weekday == 4:
-                return 3
-            elif weekday == 5:
-                return 4
-            elif weekday == 6:
-                return 5
-            elif weekday == 0:
-                return 6
-            else:
-                raise ValueError('Invalid handoff_day provided. Must be one '
-                                 'of 0, 1, 2, 3, 4, 5, 6, monday, tuesday, '
-                                 'wednesday, thursday, friday, saturday, '
-                                 'sunday')
-        else:
-            if weekday.lower() == 'monday':
-                return 0
-            elif weekday.lower() == 'tuesday':
-                return 1
-            elif weekday.lower() == 'wednesday':
-                return 2
-            elif weekday.lower() == 'thursday':
-                return 3
-            elif weekday.lower() == 'friday':
-                return 4
-            elif weekday.lower() == 'saturday':
-                return 5
-            elif weekday.lower() == 'sunday':
-                return 6
-            else:
-                raise ValueError('Invalid handoff_day provided. Must be one '
-                                 'of 0, 1, 2, 3, 4, 5, 6, monday, tuesday, '
-                                 'wednesday, thursday, friday, saturday, '
-                                 'sunday')
+        try:
+            return WEEKDAYS[self.get_day_key(weekday)]
+        except KeyError:
+            raise ValueError('Invalid handoff_day provided. Must be one '
+                             'of 0, 1, 2, 3, 4, 5, 6, monday, tuesday, '
+                             'wednesday, thursday, friday, saturday, '
+                             'sunday')
+
+    def get_day_key(self, day):
+        """Helper function to normalize a CSV day for the WEEKDAYS lookup"""
+
+        if type(day) is int:
+            return day
+        return day.strip().lower()
 
     def nullify(self, val):
         """Helper function to nullify empty strings"""
@@ -1110,7 +2619,15 @@ class Import():
 
     def __init__(self, schedule_type, csv_dir, api_key, base_name, level_name,
                  multi_name, start_date, end_date, time_zone, num_loops,
-                 escalation_delay):
+                 escalation_delay, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, keep_alive=True, rate_limit=960,
+                 max_retries=5, cache_ttl=3600, cache_size=10000,
+                 prefetch=None, prefetch_threshold=50, schedule_workers=4,
+                 file_workers=1, dry_run=None, directory_file=None,
+                 resolver=None, base_url='https://api.pagerduty.com',
+                 reconcile=False, journal=None, resume=False,
+                 transactional=False, metrics_json=None,
+                 metrics_prometheus=None, trace_file=None, backoff_cap=60.0):
         self.schedule_type = schedule_type
         self.csv_dir = csv_dir
         self.api_key = api_key
@@ -1122,66 +2639,323 @@ class Import():
         self.time_zone = time_zone
         self.num_loops = num_loops
         self.escalation_delay = escalation_delay
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.backoff_cap = backoff_cap
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+        self.prefetch_threshold = prefetch_threshold
+        self.schedule_workers = schedule_workers
+        self.file_workers = file_workers
+        self.dry_run = dry_run
+        self.directory_file = directory_file
+        self.resolver = resolver
+        self.base_url = base_url
+        self.reconcile = reconcile
+        self.journal = journal
+        self.resume = resume
+        self.transactional = transactional
+        self.metrics_json = metrics_json
+        self.metrics_prometheus = metrics_prometheus
+        self.trace_file = trace_file
 
     def execute(self):
         """Function to execute the main import logic"""
 
-        main(self.schedule_type, self.csv_dir, self.api_key, self.base_name,
-             self.level_name, self.multi_name, self.start_date, self.end_date,
-             self.time_zone, self.num_loops, self.escalation_delay)
+        return main(
+            self.schedule_type,
+            self.csv_dir,
+            self.api_key,
+            self.base_name,
+            self.level_name,
+            self.multi_name,
+            self.start_date,
+            self.end_date,
+            self.time_zone,
+            self.num_loops,
+            self.escalation_delay,
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            keep_alive=self.keep_alive,
+            rate_limit=self.rate_limit,
+            max_retries=self.max_retries,
+            backoff_cap=self.backoff_cap,
+            cache_ttl=self.cache_ttl,
+            cache_size=self.cache_size,
+            prefetch=self.prefetch,
+            prefetch_threshold=self.prefetch_threshold,
+            schedule_workers=self.schedule_workers,
+            file_workers=self.file_workers,
+            dry_run=self.dry_run,
+            directory_file=self.directory_file,
+            resolver=self.resolver,
+            base_url=self.base_url,
+            reconcile=self.reconcile,
+            journal=self.journal,
+            resume=self.resume,
+            transactional=self.transactional,
+            metrics_json=self.metrics_json,
+            metrics_prometheus=self.metrics_prometheus,
+            trace_file=self.trace_file
+        )
+
+    def execute_async(self, callback=None):
+        """Function to execute the main import logic in a background
+        thread. Returns an AsyncResult holding the import summary.
+        """
+
+        return run_async(self.execute, callback=callback)
+
+
+def run_async(function, *args, **kwargs):
+    """Function to run an import in a background thread and return an
+    AsyncResult for its result
+    """
+
+    callback = kwargs.pop('callback', None)
+    pool = ThreadPool(1)
+    try:
+        return pool.apply_async(function, args, kwargs, callback=callback)
+    finally:
+        # The worker finishes the queued import before shutting down
+        pool.close()
+
+
+def main_async(*args, **kwargs):
+    """Function to import schedules in a background thread. Takes the same
+    arguments as main plus an optional callback and returns an AsyncResult.
+    """
+
+    return run_async(main, *args, **kwargs)
+
+
+def count_identifiers(filenames, schedule_type):
+    """Count the distinct users and teams named across all CSV files"""
+
+    # Column holding the user or team in each schedule type's CSV
+    column = 1 if schedule_type == 'weekly_shifts' else 0
+    identifiers = set()
+    for filename in filenames:
+        with open(filename) as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) > column:
+                    identifiers.add(row[column].strip().lower())
+    return len(identifiers)
+
+
+def import_standard_rotation(pd_rest, file, start_date, end_date,
+                             time_zone, tracer=None):
+    """Function to import one standard rotation CSV as a schedule"""
+
+    tracer = tracer or Tracer(False)
+    standard_rotation = StandardRotationLogic(
+        start_date,
+        end_date,
+        file['base_name'],
+        time_zone
+    )
+    with tracer.span('parse_csv') as span:
+        layers = standard_rotation.parse_csv(file['filename'])
+        span.set(rows=sum(len(users) for users in layers.values()),
+                 layers=len(layers))
+    with tracer.span('check_layers'):
+        valid = standard_rotation.check_layers(layers)
+    if not valid:
+        raise ValueError('There is an issue with the {filename} CSV. '
+                         'All layers must match on layer_name, '
+                         'rotation_type, shift_length, shift_type, '
+                         'handoff_day, handoff_time, '
+                         'restriction_start_day, '
+                         'restriction_start_time, restriction_end_day,'
+                         ' and restriction_end_time.'.format(
+                            filename=file['filename']
+                         ))
+    with tracer.span('parse_layers') as span:
+        layers = standard_rotation.parse_layers(layers, pd_rest)
+        span.set(layers=len(layers))
+    with tracer.span('parse_schedules'):
+        schedule = standard_rotation.parse_schedules(layers)
+    with tracer.span('create_schedule', 'post'):
+        res = pd_rest.create_schedule(schedule)
+    print "Successfully created schedule with ID {schedule_id}".format(
+        schedule_id=res['schedule']['id']
+    )
+    return res['schedule']['id']
+
+
+def import_weekly_shifts(pd_rest, file, level_name, multi_name, start_date,
+                         end_date, time_zone, num_loops, escalation_delay,
+                         schedule_workers=1, tracer=None):
+    """Function to import one weekly shifts CSV as an escalation policy"""
+
+    tracer = tracer or Tracer(False)
+    weekly_shifts = WeeklyShiftLogic(
+        file['base_name'],
+        level_name,
+        multi_name,
+        start_date,
+        end_date,
+        time_zone,
+        num_loops,
+        escalation_delay
+    )
+    # Parse, split teams into users, resolve user IDs and split by level
+    # in one pass over the CSV
+    with tracer.span('stream_levels') as span:
+        counts = {}
+        ep_by_level = weekly_shifts.stream_levels(
+            pd_rest,
+            file['filename'],
+            counts
+        )
+        span.set(levels=len(ep_by_level), **counts)
+    with tracer.span('get_time_periods'):
+        ep_by_level = weekly_shifts.get_time_periods(ep_by_level)
+    with tracer.span('check_for_overlap') as span:
+        ep_by_level = weekly_shifts.check_for_overlap(ep_by_level)
+        span.set(schedules=sum(len(level['schedules'])
+                               for level in ep_by_level))
+    # Create schedules in PagerDuty
+    with tracer.span('create_schedules'):
+        ep_by_level = weekly_shifts.create_schedules(
+            pd_rest,
+            ep_by_level,
+            schedule_workers,
+            tracer
+        )
+    # Create escalation policy in PagerDuty
+    with tracer.span('get_escalation_policy_payload'):
+        escalation_policy_payload = (weekly_shifts
+                                     .get_escalation_policy_payload(
+                                        ep_by_level
+                                     ))
+    with tracer.span('create_escalation_policy', 'post'):
+        res = pd_rest.create_escalation_policy(escalation_policy_payload)
+    print "Successfully created escalation policy: {id}".format(
+        id=res['escalation_policy']['id']
+    )
+    return res['escalation_policy']['id']
+
+
+def import_files(import_file, files, workers=1):
+    """Function to import each CSV file and summarize the results. With more
+    than one worker the files are imported in parallel and a failing file
+    does not stop the others.
+    """
+
+    def run(file):
+        result = {
+            'filename': file['filename'],
+            'base_name': file['base_name'],
+            'id': None,
+            'error': None
+        }
+        try:
+            result['id'] = import_file(file)
+        except Exception as e:
+            if workers <= 1:
+                raise
+            result['error'] = '{error}'.format(error=e)
+        return result
+
+    if workers > 1:
+        pool = ThreadPool(min(workers, len(files)))
+        try:
+            # map keeps the summary in the same order as the files
+            summary = pool.map(run, files)
+        finally:
+            pool.close()
+    else:
+        summary = [run(file) for file in files]
+    failed = [result for result in summary if result['error']]
+    print "Imported {imported} of {total} CSV files".format(
+        imported=len(summary) - len(failed),
+        total=len(summary)
+    )
+    for result in failed:
+        print "Failed to import {filename}: {error}".format(
+            filename=result['filename'],
+            error=result['error']
+        )
+    return summary
+
+
+def rollback(transaction_rest, journal=None, workers=4):
+    """Function to delete everything an import created and drop it from the
+    journal
+    """
+
+    created = [object_id for type, object_id in transaction_rest.created]
+    failed = transaction_rest.rollback(workers)
+    if journal:
+        journal.forget(set(created) - set(result['id'] for result in failed))
+    return failed
 
 
 def main(schedule_type, csv_dir, api_key, base_name, level_name, multi_name,
-         start_date, end_date, time_zone, num_loops, escalation_delay):
+         start_date, end_date, time_zone, num_loops, escalation_delay,
+         pool_connections=10, pool_maxsize=10, pool_block=False,
+         keep_alive=True, rate_limit=960, max_retries=5, cache_ttl=3600,
+         cache_size=10000, prefetch=None, prefetch_threshold=50,
+         schedule_workers=4, file_workers=1, dry_run=None,
+         directory_file=None, resolver=None,
+         base_url='https://api.pagerduty.com', reconcile=False, journal=None,
+         resume=False, transactional=False, metrics_json=None,
+         metrics_prometheus=None, trace_file=None, backoff_cap=60.0):
     """Function to import schedules using the command line"""
 
     # Declare an instance of PagerDutyREST
-    pd_rest = PagerDutyREST(api_key)
-    # Handle trailing slash on CSV directory
-    if csv_dir[-1:] == '/':
-        csv_dir = csv_dir[:-1]
-    # Get all CSV files
-    files = glob.glob(os.path.join(os.getcwd(), csv_dir, '*.csv'))
-    if len(files) > 1:
-        for i in range(len(files)):
-            files[i] = {
-                'filename': files[i],
-                'base_name': '{name} #{number}'.format(
-                    name=base_name,
-                    number=i + 1
-                )
-            }
-    elif len(files) == 1:
-        files[0] = {
-            'filename': files[0],
-            'base_name': base_name
-        }
-    else:
-        raise Exception('No CSV files found.')
+    pd_rest = PagerDutyREST(
+        api_key,
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block,
+        keep_alive=keep_alive,
+        rate_limit=rate_limit,
+        max_retries=max_retries,
+        backoff_cap=backoff_cap,
+        cache_ttl=cache_ttl,
+        cache_size=cache_size,
+        base_url=base_url
+    )
+    metrics = pd_rest.metrics
+    # Time each stage of the import when a trace file is requested
+    tracer = Tracer(bool(trace_file))
+    if trace_file:
+        pd_rest.tracer = tracer
+    # Validate every argument before anything is fetched or opened
+    if dry_run and reconcile:
+        raise ValueError('Invalid command line arguments. --reconcile cannot '
+                         'be combined with --dry-run.')
+    if dry_run and journal:
+        raise ValueError('Invalid command line arguments. --journal cannot '
+                         'be combined with --dry-run.')
+    # A rollback can only delete what was created, not undo the updates and
+    # deletions made by reconcile mode
+    if transactional and reconcile:
+        raise ValueError('Invalid command line arguments. --transactional '
+                         'cannot be combined with --reconcile.')
+    if resume and not journal:
+        raise ValueError('Invalid command line arguments. --resume requires '
+                         '--journal.')
     # Check on the schedule type
     if schedule_type == 'standard_rotation':
-        # Loop through all CSV files
-        for file in files:
-            standard_rotation = StandardRotationLogic(
+        def import_schedule(pd_rest, file):
+            return import_standard_rotation(
+                pd_rest,
+                file,
                 start_date,
                 end_date,
-                file['base_name'],
-                time_zone
-            )
-            layers = standard_rotation.parse_csv(file['filename'])
-            if not standard_rotation.check_layers(layers):
-                raise ValueError('There is an issue with the {filename} CSV. '
-                                 'All layers must match on layer_name, '
-                                 'rotation_type, shift_length, shift_type, '
-                                 'handoff_day, handoff_time, '
-                                 'restriction_start_day, '
-                                 'restriction_start_time, restriction_end_day,'
-                                 ' and restriction_end_time.')
-            layers = standard_rotation.parse_layers(layers, pd_rest)
-            schedule = standard_rotation.parse_schedules(layers)
-            res = pd_rest.create_schedule(schedule)
-            print "Successfully created schedule with ID {schedule_id}".format(
-                schedule_id=res['schedule']['id']
+                time_zone,
+                tracer
             )
     elif schedule_type == 'weekly_shifts':
         if (not level_name or not multi_name or not num_loops
@@ -1191,59 +2965,135 @@ def main(schedule_type, csv_dir, api_key, base_name, level_name, multi_name,
                              '--level-name, --multi-name, --start-date, '
                              '--time-zone, --num-loops, and '
                              '--escalation-delay.')
-        # Loop through all CSV files
-        for file in files:
-            weekly_shifts = WeeklyShiftLogic(
-                file['base_name'],
+
+        def import_schedule(pd_rest, file):
+            return import_weekly_shifts(
+                pd_rest,
+                file,
                 level_name,
                 multi_name,
                 start_date,
                 end_date,
                 time_zone,
                 num_loops,
-                escalation_delay
-            )
-            days = weekly_shifts.create_days_of_week(file['filename'])
-            # Split teams into their particular users
-            days = weekly_shifts.split_teams_into_users(pd_rest, days)
-            # Update user names/emails to user IDs
-            days = weekly_shifts.get_user_ids(pd_rest, days)
-            # Create list of escalation policies by level
-            base_ep = [{
-                'schedules': [{
-                    'name': weekly_shifts.base_name,
-                    'days': days
-                }]
-            }]
-            ep_by_level = weekly_shifts.split_days_by_level(base_ep)
-            # TODO: Handle cominbing cases where one on-call starts at 0:00 and another ends at 24:00 # NOQA
-            ep_by_level = weekly_shifts.get_time_periods(ep_by_level)
-            ep_by_level = weekly_shifts.check_for_overlap(ep_by_level)
-            # Create schedules in PagerDuty
-            for i, level in enumerate(ep_by_level):
-                for j, schedule in enumerate(level['schedules']):
-                    schedule_by_periods = weekly_shifts.concat_time_periods(
-                        schedule
-                    )
-                    schedule_payload = weekly_shifts.get_schedule_payload(
-                        schedule_by_periods
-                    )
-                    schedule_id = pd_rest.create_schedule(
-                        schedule_payload
-                    )['schedule']['id']
-                    ep_by_level[i]['schedules'][j] = schedule_id
-            # Create escalation policy in PagerDuty
-            escalation_policy_payload = (weekly_shifts
-                                         .get_escalation_policy_payload(
-                                            ep_by_level
-                                         ))
-            res = pd_rest.create_escalation_policy(escalation_policy_payload)
-            print "Successfully created escalation policy: {id}".format(
-                id=res['escalation_policy']['id']
+                escalation_delay,
+                schedule_workers,
+                tracer
             )
     else:
         raise ValueError('Invalid command line arguments. --schedule-type must'
                          ' one of standard_rotation, weekly_shifts.')
+    # Handle trailing slash on CSV directory
+    if csv_dir[-1:] == '/':
+        csv_dir = csv_dir[:-1]
+    # Get all CSV files
+    files = sorted(glob.glob(os.path.join(os.getcwd(), csv_dir, '*.csv')))
+    if len(files) > 1:
+        for i in range(len(files)):
+            files[i] = {
+                'filename': files[i],
+                'base_name': '{name} #{number}'.format(
+                    name=base_name,
+                    number=i + 1
+                )
+            }
+    elif len(files) == 1:
+        files[0] = {
+            'filename': files[0],
+            'base_name': base_name
+        }
+    else:
+        raise Exception('No CSV files found.')
+    # A dry run creates nothing to roll back
+    transactional = transactional and not dry_run
+    journal_filename = journal
+    journal = None
+    output = None
+
+    def import_file(file):
+        # Every span of the file, on any thread, is recorded under it
+        with tracer.span('import_file', 'file', file=file['filename'],
+                         base_name=file['base_name']):
+            file_rest = pd_rest
+            if journal:
+                file_key = journal.get_file_key(file['filename'])
+                object_id = journal.get(file_key, 'file', file['base_name'])
+                if object_id:
+                    print ("Skipping {filename}, already imported as {id}"
+                           .format(filename=file['filename'], id=object_id))
+                    return object_id
+            if reconcile:
+                file_rest = reconciling_rest = ReconcilingREST(
+                    file_rest,
+                    file['base_name'],
+                    schedule_workers
+                )
+            if journal:
+                file_rest = JournalREST(file_rest, journal, file_key)
+            object_id = import_schedule(file_rest, file)
+            if reconcile:
+                with tracer.span('reconcile_finish'):
+                    reconciling_rest.finish()
+            if journal:
+                journal.record(file_key, 'file', file['base_name'], object_id)
+            return object_id
+
+    try:
+        # Write the payloads to a JSONL file instead of creating them
+        if dry_run:
+            if not resolver and directory_file:
+                with open(directory_file) as f:
+                    directory = json.load(f)
+                resolver = LocalResolver(
+                    directory.get('users', []),
+                    directory.get('teams', [])
+                )
+            if hasattr(dry_run, 'write'):
+                pd_rest = DryRunREST(dry_run, resolver or pd_rest)
+            else:
+                output = open(dry_run, 'w')
+                pd_rest = DryRunREST(output, resolver or pd_rest)
+        # Index the whole directory when that is cheaper than one lookup per
+        # name
+        if prefetch is None:
+            prefetch = count_identifiers(
+                [file['filename'] for file in files],
+                schedule_type
+            ) > prefetch_threshold
+        if prefetch:
+            with tracer.span('prefetch_directory'):
+                pd_rest.prefetch_directory()
+        # Track everything created so a failed import can be torn down
+        if transactional:
+            pd_rest = TransactionREST(pd_rest)
+        if journal_filename:
+            journal = Journal(journal_filename, resume)
+        # The objects a rollback could not delete are handed to the caller
+        # to clean up, on the raised error or in the summary
+        try:
+            summary = import_files(import_file, files, file_workers)
+        except Exception as e:
+            if transactional:
+                e.rollback_failures = rollback(pd_rest, journal,
+                                               schedule_workers)
+            raise
+        if transactional and any(result['error'] for result in summary):
+            failed = rollback(pd_rest, journal, schedule_workers)
+            for result in summary:
+                result['id'] = None
+                result['rollback_failures'] = failed
+        return summary
+    finally:
+        if output:
+            output.close()
+        if journal:
+            journal.close()
+        if metrics_json:
+            metrics.write_json(metrics_json)
+        if metrics_prometheus:
+            metrics.write_prometheus(metrics_prometheus)
+        if trace_file:
+            tracer.write(trace_file)
 
 # TODO: Write tests for various arguments
 # TODO: Use list comprehension where applicable
@@ -1320,8 +3170,165 @@ if __name__ == '__main__':
               ' the next level'),
         dest='escalation_delay'
     )
+    parser.add_argument(
+        '--pool-connections',
+        help='The number of per-host connection pools to keep cached',
+        dest='pool_connections',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--pool-maxsize',
+        help='The maximum number of connections to keep open per host',
+        dest='pool_maxsize',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--pool-block',
+        help=('Wait for a free pooled connection instead of opening more than '
+              '--pool-maxsize connections to a host'),
+        dest='pool_block',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--no-keep-alive',
+        help='Close each connection after its request instead of reusing it',
+        dest='keep_alive',
+        action='store_false'
+    )
+    parser.add_argument(
+        '--rate-limit',
+        help=('The maximum number of REST API requests to send per minute. '
+              'Set to 0 to disable client-side throttling.'),
+        dest='rate_limit',
+        type=int,
+        default=960
+    )
+    parser.add_argument(
+        '--max-retries',
+        help=('The number of times to retry a request that was rate limited '
+              'or failed with a server error'),
+        dest='max_retries',
+        type=int,
+        default=5
+    )
+    parser.add_argument(
+        '--backoff-cap',
+        help=('The most seconds to wait between retries of a request without '
+              'a Retry-After header'),
+        dest='backoff_cap',
+        type=float,
+        default=60.0
+    )
+    parser.add_argument(
+        '--prefetch',
+        help=('Index all users and teams before processing the CSVs instead '
+              'of looking up each one. By default this happens when the CSVs '
+              'name more than --prefetch-threshold users and teams.'),
+        dest='prefetch',
+        action='store_true',
+        default=None
+    )
+    parser.add_argument(
+        '--no-prefetch',
+        help='Look up each user and team individually',
+        dest='prefetch',
+        action='store_false'
+    )
+    parser.add_argument(
+        '--prefetch-threshold',
+        help=('The number of distinct users and teams in the CSVs above which '
+              'the directory is prefetched'),
+        dest='prefetch_threshold',
+        type=int,
+        default=50
+    )
+    parser.add_argument(
+        '--schedule-workers',
+        help=('The number of schedules to create at the same time for each '
+              'escalation policy'),
+        dest='schedule_workers',
+        type=int,
+        default=4
+    )
+    parser.add_argument(
+        '--file-workers',
+        help=('The number of CSV files to import at the same time. With more '
+              'than one worker a failing file does not stop the others.'),
+        dest='file_workers',
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        '--dry-run',
+        help=('Path to a JSONL file to write every schedule and escalation '
+              'policy payload to instead of creating them in PagerDuty'),
+        dest='dry_run'
+    )
+    parser.add_argument(
+        '--directory-file',
+        help=('Path to a JSON file with "users" and "teams" lists in the '
+              'format of the REST API to resolve users and teams from during '
+              'a --dry-run. Without it they are looked up with --api-key.'),
+        dest='directory_file'
+    )
+    parser.add_argument(
+        '--base-url',
+        help=('Base URL of the PagerDuty REST API, for example a local '
+              'stand-in started with scheduleduty/local_server.py'),
+        dest='base_url',
+        default='https://api.pagerduty.com'
+    )
+    parser.add_argument(
+        '--reconcile',
+        help=('Update the schedules and escalation policies left by a '
+              'previous import of the same --base-name in place, skip the '
+              'ones that did not change and delete the ones no longer '
+              'produced, instead of creating new ones'),
+        dest='reconcile',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--journal',
+        help=('Path to a file recording each schedule, escalation policy and '
+              'CSV file completed by the import'),
+        dest='journal'
+    )
+    parser.add_argument(
+        '--resume',
+        help=('Carry on from the --journal of an import that failed, skipping '
+              'the work it records as completed'),
+        dest='resume',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--transactional',
+        help=('Delete every schedule and escalation policy created by the '
+              'import if any CSV file fails to import'),
+        dest='transactional',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--metrics-json',
+        help=('Path to a JSON file to write the REST API call counts, status '
+              'codes, retries, bytes and latencies per endpoint to'),
+        dest='metrics_json'
+    )
+    parser.add_argument(
+        '--metrics-prometheus',
+        help=('Path to a file to write the same metrics to in the Prometheus '
+              'text format'),
+        dest='metrics_prometheus'
+    )
+    parser.add_argument(
+        '--trace-file',
+        help=('Path to a JSON file to write a timeline of each import stage '
+              'and REST API call to, in the Chrome trace event format'),
+        dest='trace_file'
+    )
     args = parser.parse_args()
-    main(
+    summary = main(
         args.schedule_type,
         args.csv_dir,
         args.api_key,
@@ -1332,5 +3339,28 @@ if __name__ == '__main__':
         args.end_date,
         args.time_zone,
         args.num_loops,
-        args.escalation_delay
+        args.escalation_delay,
+        pool_connections=args.pool_connections,
+        pool_maxsize=args.pool_maxsize,
+        pool_block=args.pool_block,
+        keep_alive=args.keep_alive,
+        rate_limit=args.rate_limit,
+        max_retries=args.max_retries,
+        backoff_cap=args.backoff_cap,
+        prefetch=args.prefetch,
+        prefetch_threshold=args.prefetch_threshold,
+        schedule_workers=args.schedule_workers,
+        file_workers=args.file_workers,
+        dry_run=args.dry_run,
+        directory_file=args.directory_file,
+        base_url=args.base_url,
+        reconcile=args.reconcile,
+        journal=args.journal,
+        resume=args.resume,
+        transactional=args.transactional,
+        metrics_json=args.metrics_json,
+        metrics_prometheus=args.metrics_prometheus,
+        trace_file=args.trace_file
     )
+    if any(result['error'] for result in summary):
+        sys.exit(1)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2016, PagerDuty, Inc. <info@pagerduty.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of PagerDuty Inc nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL PAGERDUTY INC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from scheduleduty import scheduleduty  # NOQA
+
+baseline_filename = os.path.join(
+    os.path.dirname(__file__),
+    './expected_results/benchmark_baseline.json'
+)
+
+# The parse stage of each schedule type. The baseline stores every stage as
+# a multiple of it, so that it holds on machines of different speeds.
+REFERENCE_STAGES = {
+    'weekly_shifts': 'stream_levels',
+    'standard_rotation': 'parse_csv'
+}
+# (rows, escalation levels or layers, overlap density) run by default
+SCENARIOS = [
+    (10, 1, 0.1),
+    (1000, 5, 0.25),
+    (100000, 50, 0.5)
+]
+DAYS = ('Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+        'Saturday', 'weekdays', 'weekends', 'all')
+
+
+def get_user(number):
+    """Get the directory entry of a generated user"""
+
+    return {
+        'id': 'PU{number:06d}'.format(number=number),
+        'name': 'Bench User {number:06d}'.format(number=number),
+        'email': 'bench{number:06d}@example.com'.format(number=number),
+        'teams': []
+    }
+
+
+def write_weekly_shifts(filename, rows, levels, overlap, seed=0):
+    """Write a weekly shifts CSV. Shifts last overlap * 24 hours, so a
+    higher overlap density puts more users on-call at the same time.
+    """
+
+    generator = random.Random(seed)
+    # Half hour slots, at least one and at most the whole day
+    length = min(max(int(overlap * 48), 1), 48)
+    num_users = max(rows // 10, 1)
+    with open(filename, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['escalation_level', 'user_or_team', 'type',
+                         'day_of_week', 'start_time', 'end_time'])
+        for i in range(rows):
+            start = generator.randint(0, 48 - length)
+            writer.writerow([
+                generator.randint(1, levels),
+                get_user(generator.randint(1, num_users))['name'],
+                'User',
+                generator.choice(DAYS),
+                '{hours}:{minutes:02d}'.format(hours=start // 2,
+                                               minutes=start % 2 * 30),
+                '{hours}:{minutes:02d}'.format(
+                    hours=(start + length) // 2,
+                    minutes=(start + length) % 2 * 30
+                )
+            ])
+    return [get_user(number) for number in range(1, num_users + 1)]
+
+
+def write_standard_rotation(filename, rows, layers, overlap, seed=0):
+    """Write a standard rotation CSV with the rows spread over the layers.
+    Restrictions last overlap * 7 days, so a higher overlap density makes
+    the layers cover more of the week.
+    """
+
+    generator = random.Random(seed)
+    duration = min(max(int(overlap * 7), 1), 6)
+    settings = []
+    for layer in range(layers):
+        start_day = generator.randint(0, 6)
+        settings.append([
+            'Layer {layer}'.format(layer=layer + 1),
+            'weekly',
+            '',
+            '',
+            scheduleduty.DAY_NAMES[generator.randint(0, 6)],
+            '{hours}:00'.format(hours=generator.randint(0, 23)),
+            scheduleduty.DAY_NAMES[start_day],
+            '08:00',
+            scheduleduty.DAY_NAMES[(start_day + duration) % 7],
+            '17:00'
+        ])
+    with open(filename, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['user', 'layer', 'layer_name', 'rotation_type',
+                         'shift_length', 'shift_type', 'handoff_day',
+                         'handoff_time', 'restriction_start_day',
+                         'restriction_start_time', 'restriction_end_day',
+                         'restriction_end_time'])
+        for i in range(rows):
+            writer.writerow([get_user(i + 1)['name'], i % layers + 1] +
+                            settings[i % layers])
+    return [get_user(number) for number in range(1, rows + 1)]
+
+
+def time_stage(timings, stage, function, *args):
+    """Run one stage, keeping its fastest time, and return its result"""
+
+    start = time.time()
+    result = function(*args)
+    elapsed = time.time() - start
+    timings[stage] = round(min(timings.get(stage, elapsed), elapsed), 6)
+    return result
+
+
+def run_weekly_shifts(filename, users, timings):
+    """Time each stage of the weekly shifts pipeline once"""
+
+    resolver = scheduleduty.LocalResolver(users, [])
+    weekly_shifts = scheduleduty.WeeklyShiftLogic('Benchmark', 'Level',
+                                                  'Multi', '2017-01-01',
+                                                  '2017-02-01', 'UTC', 1, 30)
+    # Parsing, team expansion, ID resolution and the split by level run
+    # fused in one pass, as they do in an import. The generated rosters put
+    # far more users on a level than PagerDuty allows, so lift the limit
+    # for this stage only.
+    max_level_targets = scheduleduty.MAX_LEVEL_TARGETS
+    scheduleduty.MAX_LEVEL_TARGETS = sys.maxint
+    try:
+        ep_by_level = time_stage(timings, 'stream_levels',
+                                 weekly_shifts.stream_levels, resolver,
+                                 filename)
+    finally:
+        scheduleduty.MAX_LEVEL_TARGETS = max_level_targets
+    ep_by_level = time_stage(timings, 'get_time_periods',
+                             weekly_shifts.get_time_periods, ep_by_level)
+    ep_by_level = time_stage(timings, 'check_for_overlap',
+                             weekly_shifts.check_for_overlap, ep_by_level)
+    schedules = [schedule for level in ep_by_level
+                 for schedule in level['schedules']]
+    schedules = time_stage(timings, 'concat_time_periods',
+                           lambda: [weekly_shifts.concat_time_periods(schedule)
+                                    for schedule in schedules])
+    time_stage(timings, 'get_schedule_payload',
+               lambda: [weekly_shifts.get_schedule_payload(schedule)
+                        for schedule in schedules])
+    time_stage(timings, 'get_schedule_payloads',
+               weekly_shifts.get_schedule_payloads, schedules)
+
+
+def run_standard_rotation(filename, users, timings):
+    """Time each stage of the standard rotation pipeline once"""
+
+    resolver = scheduleduty.LocalResolver(users, [])
+    standard_rotation = scheduleduty.StandardRotationLogic('2017-01-01',
+                                                           '2017-02-01',
+                                                           'Benchmark', 'UTC')
+    layers = time_stage(timings, 'parse_csv', standard_rotation.parse_csv,
+                        filename)
+    if not time_stage(timings, 'check_layers', standard_rotation.check_layers,
+                      layers):
+        raise ValueError('Generated layers do not match')
+    layers = time_stage(timings, 'parse_layers',
+                        standard_rotation.parse_layers, layers, resolver)
+    time_stage(timings, 'parse_schedules', standard_rotation.parse_schedules,
+               layers)
+
+
+def get_ratios(schedule_type, timings):
+    """Get each stage's time as a multiple of the parse stage"""
+
+    reference = max(timings[REFERENCE_STAGES[schedule_type]], 0.000001)
+    return dict((stage, round(seconds / reference, 3))
+                for stage, seconds in timings.items())
+
+
+def run_benchmarks(scenarios, schedule_types, repeat):
+    """Generate a CSV for each scenario and time every stage"""
+
+    results = []
+    directory = tempfile.mkdtemp()
+    try:
+        for schedule_type in schedule_types:
+            for rows, levels, overlap in scenarios:
+                filename = os.path.join(directory, '{type}.csv'.format(
+                    type=schedule_type
+                ))
+                if schedule_type == 'weekly_shifts':
+                    users = write_weekly_shifts(filename, rows, levels,
+                                                overlap)
+                    run = run_weekly_shifts
+                else:
+                    users = write_standard_rotation(filename, rows, levels,
+                                                    overlap)
+                    run = run_standard_rotation
+                timings = {}
+                for i in range(repeat):
+                    run(filename, users, timings)
+                results.append({
+                    'schedule_type': schedule_type,
+                    'rows': rows,
+                    'levels': levels,
+                    'overlap': overlap,
+                    'stages': timings,
+                    'ratios': get_ratios(schedule_type, timings)
+                })
+                print '{type} rows={rows} levels={levels} overlap={overlap}: '\
+                    '{total:.4f}s'.format(type=schedule_type, rows=rows,
+                                          levels=levels, overlap=overlap,
+                                          total=sum(timings.values()))
+                for stage, seconds in sorted(timings.items()):
+                    print '    {stage}: {seconds:.4f}s'.format(
+                        stage=stage,
+                        seconds=seconds
+                    )
+    finally:
+        shutil.rmtree(directory)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Get the stages whose time relative to the parse stage is more than
+    tolerance above the baseline. Stages faster than 1ms are too noisy to
+    compare.
+    """
+
+    def get_key(result):
+        return (result['schedule_type'], result['rows'], result['levels'],
+                result['overlap'])
+
+    baseline = dict((get_key(result), result) for result in baseline)
+    regressions = []
+    for result in results:
+        if get_key(result) not in baseline:
+            continue
+        expected = baseline[get_key(result)]['ratios']
+        for stage, ratio in sorted(result['ratios'].items()):
+            if (stage in expected and result['stages'][stage] > 0.001 and
+                    ratio > expected[stage] * (1 + tolerance)):
+                regressions.append({
+                    'schedule_type': result['schedule_type'],
+                    'rows': result['rows'],
+                    'levels': result['levels'],
+                    'overlap': result['overlap'],
+                    'stage': stage,
+                    'reference': REFERENCE_STAGES[result['schedule_type']],
+                    'baseline': expected[stage],
+                    'ratio': ratio
+                })
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ScheduleDuty Benchmarks')
+    parser.add_argument(
+        '--rows',
+        help='Numbers of CSV rows to benchmark, for example 10 1000 1000000',
+        dest='rows',
+        type=int,
+        nargs='+'
+    )
+    parser.add_argument(
+        '--levels',
+        help='Numbers of escalation levels or layers to benchmark',
+        dest='levels',
+        type=int,
+        nargs='+'
+    )
+    parser.add_argument(
+        '--overlap',
+        help=('Overlap densities between 0 and 1 to benchmark. Higher values '
+              'put more users on-call at the same time.'),
+        dest='overlap',
+        type=float,
+        nargs='+'
+    )
+    parser.add_argument(
+        '--schedule-type',
+        help='Schedule types to benchmark',
+        dest='schedule_types',
+        nargs='+',
+        default=['weekly_shifts', 'standard_rotation']
+    )
+    parser.add_argument(
+        '--repeat',
+        help='Number of runs per scenario. The fastest time is kept.',
+        dest='repeat',
+        type=int,
+        default=3
+    )
+    parser.add_argument(
+        '--baseline',
+        help='Path to the baseline JSON file',
+        dest='baseline',
+        default=baseline_filename
+    )
+    parser.add_argument(
+        '--tolerance',
+        help=('Fraction a stage may be slower than its baseline, relative '
+              'to the parse stage'),
+        dest='tolerance',
+        type=float,
+        default=0.5
+    )
+    parser.add_argument(
+        '--save-baseline',
+        help='Write the results to the baseline file instead of comparing',
+        dest='save_baseline',
+        action='store_true'
+    )
+    args = parser.parse_args()
+    if args.rows or args.levels or args.overlap:
+        scenarios = list(itertools.product(
+            args.rows or [1000],
+            args.levels or [5],
+            args.overlap or [0.25]
+        ))
+    else:
+        scenarios = SCENARIOS
+    results = run_benchmarks(scenarios, args.schedule_types, args.repeat)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'results': [dict((key, value)
+                                 for key, value in result.items()
+                                 if key != 'stages') for result in results]
+            }, f, indent=2, separators=(',', ': '), sort_keys=True)
+            f.write('\n')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for regression in regressions:
+            print 'Regression in {stage} for {schedule_type} rows={rows} '\
+                'levels={levels} overlap={overlap}: {ratio:.3f}x vs '\
+                '{baseline:.3f}x {reference}'.format(**regression)
+        if regressions:
+            sys.exit(1)
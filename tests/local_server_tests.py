@@ -0,0 +1,818 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2016, PagerDuty, Inc. <info@pagerduty.com>
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of PagerDuty Inc nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL PAGERDUTY INC BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+import sys
+import os
+import shutil
+import json
+import tempfile
+import threading
+import time
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from scheduleduty import scheduleduty  # NOQA
+from scheduleduty import local_server  # NOQA
+
+
+class FailingEscalationPolicyREST(scheduleduty.DelegatingREST):
+    """Stand-in for PagerDutyREST that fails to create escalation policies"""
+
+    def create_escalation_policy(self, payload):
+        raise ValueError('create_escalation_policy returned status code 500')
+
+
+class LocalServerTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.stand_in = local_server.LocalPagerDuty(num_users=250, num_teams=2)
+        team = cls.stand_in.add_team('Import Team')
+        for i in range(1, 5):
+            cls.stand_in.add_user(
+                'Import User {number}'.format(number=i),
+                'lucas+import{number}@pagerduty.com'.format(number=i),
+                [team['id']] if i == 4 else []
+            )
+        cls.stand_in.start()
+        cls.pd_rest = scheduleduty.PagerDutyREST(
+            'EXAMPLE_KEY',
+            rate_limit=0,
+            base_url=cls.stand_in.base_url
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pd_rest.close()
+        cls.stand_in.stop()
+
+    def lookups(self):
+        team = self.stand_in.teams[1]
+        user = self.stand_in.users[1]
+        self.assertEqual(self.pd_rest.get_team_id(team['name']), team['id'])
+        self.assertEqual(self.pd_rest.get_user_id(user['email']), user['id'])
+        self.assertEqual(
+            [member['id'] for member in
+             self.pd_rest.get_users_in_team(team['id'])],
+            [member['id'] for member in self.stand_in.users[1:250:2]]
+        )
+
+    def create_and_delete(self):
+        schedule_id = self.pd_rest.create_schedule(
+            {'schedule': {'name': 'Local Schedule'}}
+        )['schedule']['id']
+        escalation_policy_id = self.pd_rest.create_escalation_policy(
+            {'escalation_policy': {'name': 'Local Escalation Policy'}}
+        )['escalation_policy']['id']
+        self.assertIn(schedule_id, self.stand_in.objects['schedules'])
+        self.assertEqual(
+            self.pd_rest.delete_escalation_policy(escalation_policy_id),
+            204
+        )
+        self.assertEqual(self.pd_rest.delete_schedule(schedule_id), 204)
+        self.assertEqual(self.stand_in.objects['schedules'], {})
+
+    def rate_limit(self):
+        stand_in = local_server.LocalPagerDuty(rate_limit=1, rate_window=1.0)
+        pd_rest = scheduleduty.PagerDutyREST(
+            'EXAMPLE_KEY',
+            rate_limit=0,
+            base_url=stand_in.start()
+        )
+        try:
+            team = stand_in.teams[0]
+            user = stand_in.users[0]
+            self.assertEqual(pd_rest.get_team_id(team['name']), team['id'])
+            # The second request is throttled, then retried after the window
+            self.assertEqual(pd_rest.get_user_id(user['email']), user['id'])
+            self.assertEqual(stand_in.stats[('GET', 'users')], 2)
+        finally:
+            pd_rest.close()
+            stand_in.stop()
+
+    def throttle(self):
+        stand_in = local_server.LocalPagerDuty(num_users=11, num_teams=0,
+                                               rate_limit=12, rate_window=1.0)
+        # 10 requests a second with no burst
+        pd_rest = scheduleduty.PagerDutyREST(
+            'EXAMPLE_KEY',
+            rate_limit=600,
+            burst=1,
+            base_url=stand_in.start()
+        )
+        try:
+            start = time.time()
+            for user in stand_in.users:
+                pd_rest.get_user_id(user['email'])
+            elapsed = time.time() - start
+        finally:
+            pd_rest.close()
+            stand_in.stop()
+        # The first request uses the burst and the other ten wait their turn
+        self.assertGreaterEqual(elapsed, 0.95)
+        self.assertLess(elapsed, 1.6)
+        self.assertEqual(sum(stats['retries'] for stats in
+                             pd_rest.get_metrics()['endpoints']), 0)
+
+    def shared_pause(self):
+        stand_in = local_server.LocalPagerDuty(num_users=4, num_teams=0,
+                                               rate_limit=2, rate_window=1.0)
+        pd_rest = scheduleduty.PagerDutyREST(
+            'EXAMPLE_KEY',
+            rate_limit=6000,
+            max_retries=3,
+            base_url=stand_in.start()
+        )
+        emails = [user['email'] for user in stand_in.users]
+
+        def get_requests():
+            return stand_in.stats.get(('GET', 'users'), 0)
+
+        try:
+            # Use up the window so the next request is rate limited
+            pd_rest.get_user_id(emails[0])
+            pd_rest.get_user_id(emails[1])
+            throttled = threading.Thread(target=pd_rest.get_user_id,
+                                         args=(emails[2],))
+            throttled.start()
+            while get_requests() < 3:
+                time.sleep(0.01)
+            # Give the throttled caller time to read its 429
+            time.sleep(0.2)
+            start = time.time()
+            self.assertEqual(pd_rest.get_user_id(emails[3]),
+                             stand_in.users[3]['id'])
+            elapsed = time.time() - start
+            throttled.join()
+        finally:
+            pd_rest.close()
+            stand_in.stop()
+        # The 429 held back this caller too, so it waited for the next
+        # window instead of being rate limited itself
+        self.assertGreaterEqual(elapsed, 0.5)
+        self.assertEqual(get_requests(), 5)
+
+    def error_injection(self):
+        stand_in = local_server.LocalPagerDuty(error_rate=1.0)
+        pd_rest = scheduleduty.PagerDutyREST(
+            'EXAMPLE_KEY',
+            rate_limit=0,
+            max_retries=2,
+            backoff_cap=0.01,
+            base_url=stand_in.start()
+        )
+        try:
+            with self.assertRaises(ValueError):
+                pd_rest.create_schedule({'schedule': {'name': 'Failing'}})
+            # A POST that failed with a server error may have been committed
+            self.assertEqual(stand_in.stats[('POST', 'schedules')], 1)
+            with self.assertRaises(ValueError):
+                pd_rest.delete_schedule('PMISSING')
+            self.assertEqual(stand_in.stats[('DELETE', 'schedules')], 3)
+        finally:
+            pd_rest.close()
+            stand_in.stop()
+
+    def async_rest(self):
+        stand_in = local_server.LocalPagerDuty(num_users=20, latency=0.05)
+        async_rest = scheduleduty.AsyncPagerDutyREST(
+            'EXAMPLE_KEY',
+            concurrency=3,
+            rate_limit=0,
+            base_url=stand_in.start()
+        )
+        user_ids = []
+        try:
+            results = [
+                async_rest.get_user_id(user['email'], callback=user_ids.append)
+                for user in stand_in.users
+            ]
+            self.assertEqual([result.get(30) for result in results],
+                             [user['id'] for user in stand_in.users])
+        finally:
+            async_rest.close()
+            stand_in.stop()
+        self.assertEqual(sorted(user_ids),
+                         sorted(user['id'] for user in stand_in.users))
+        # The worker count bounds the calls in flight
+        self.assertLessEqual(stand_in.max_in_flight, 3)
+        self.assertGreater(stand_in.max_in_flight, 1)
+
+    def import_async(self):
+        args = ['weekly_shifts', None, 'EXAMPLE_KEY', 'Local Async', 'Level',
+                'Multi', '2017-01-01', '2017-02-01', 'UTC', 1, 30]
+        summaries = []
+        directory = tempfile.mkdtemp()
+        try:
+            shutil.copy('tests/csv/weekly_shifts_test.csv', directory)
+            args[1] = directory
+            import_summary = scheduleduty.Import(
+                *args,
+                rate_limit=0,
+                base_url=self.stand_in.base_url
+            ).execute_async(callback=summaries.append).get(30)
+            main_summary = scheduleduty.main_async(
+                *args,
+                rate_limit=0,
+                base_url=self.stand_in.base_url,
+                callback=summaries.append
+            ).get(30)
+            failing = scheduleduty.main_async(
+                'unknown_type',
+                *args[1:],
+                rate_limit=0,
+                base_url=self.stand_in.base_url,
+                callback=summaries.append
+            )
+            with self.assertRaises(ValueError):
+                failing.get(30)
+        finally:
+            shutil.rmtree(directory)
+        # The callback gets each summary and is skipped when the import fails
+        self.assertEqual(summaries, [import_summary, main_summary])
+        for summary in summaries:
+            self.assertIsNone(summary[0]['error'])
+            self.assertIn(summary[0]['id'],
+                          self.stand_in.objects['escalation_policies'])
+        self.assertNotEqual(import_summary[0]['id'], main_summary[0]['id'])
+
+    def resolution_cache(self):
+        stand_in = local_server.LocalPagerDuty(num_users=3, num_teams=0)
+        pd_rest = scheduleduty.PagerDutyREST(
+            'EXAMPLE_KEY',
+            rate_limit=0,
+            cache_ttl=0.5,
+            cache_size=4,
+            base_url=stand_in.start()
+        )
+        emails = [user['email'] for user in stand_in.users]
+
+        def get_requests():
+            return stand_in.stats.get(('GET', 'users'), 0)
+
+        try:
+            pd_rest.get_user_id(emails[0])
+            pd_rest.get_user_id(emails[0])
+            pd_rest.get_user_id(emails[1])
+            self.assertEqual(get_requests(), 2)
+            # Each lookup caches the query and the ID, so the third user
+            # evicts the least recently used second user
+            pd_rest.get_user_id(emails[0])
+            pd_rest.get_user_id(emails[2])
+            pd_rest.get_user_id(emails[0])
+            self.assertEqual(get_requests(), 3)
+            pd_rest.get_user_id(emails[1])
+            self.assertEqual(get_requests(), 4)
+            # Expired entries are looked up again
+            time.sleep(0.6)
+            pd_rest.get_user_id(emails[1])
+            self.assertEqual(get_requests(), 5)
+        finally:
+            pd_rest.close()
+            stand_in.stop()
+
+    def get_all(self):
+        stand_in = local_server.LocalPagerDuty(num_users=250, latency=0.05)
+        pd_rest = scheduleduty.PagerDutyREST(
+            'EXAMPLE_KEY',
+            rate_limit=0,
+            base_url=stand_in.start()
+        )
+        try:
+            users = pd_rest.get_all('/users', 'users', workers=2)
+        finally:
+            pd_rest.close()
+            stand_in.stop()
+        self.assertEqual(users, stand_in.users)
+        self.assertEqual(stand_in.stats[('GET', 'users')], 3)
+        # The two pages after the first are fetched at the same time
+        self.assertEqual(stand_in.max_in_flight, 2)
+
+    def ambiguous_directory(self):
+        stand_in = local_server.LocalPagerDuty(num_users=0, num_teams=0)
+        twins = [stand_in.add_user('Local Twin', email)
+                 for email in ['twin1@example.com', 'twin2@example.com']]
+        pd_rest = scheduleduty.PagerDutyREST(
+            'EXAMPLE_KEY',
+            rate_limit=0,
+            base_url=stand_in.start()
+        )
+        try:
+            directory = pd_rest.prefetch_directory()
+            requests = stand_in.stats[('GET', 'users')]
+            # A name shared by two users is left out of the index
+            self.assertIsNone(
+                directory[scheduleduty.get_directory_key('user', 'Local Twin')]
+            )
+            self.assertEqual(pd_rest.get_user_id('twin2@example.com'),
+                             twins[1]['id'])
+            self.assertEqual(stand_in.stats[('GET', 'users')], requests)
+            # and goes to the API, which finds both
+            with self.assertRaises(ValueError):
+                pd_rest.get_user_id('Local Twin')
+            self.assertEqual(stand_in.stats[('GET', 'users')], requests + 1)
+        finally:
+            pd_rest.close()
+            stand_in.stop()
+
+    def prefetch_threshold(self):
+        directory = tempfile.mkdtemp()
+        try:
+            shutil.copy('tests/csv/weekly_shifts_test.csv', directory)
+            identifiers = scheduleduty.count_identifiers(
+                [os.path.join(directory, 'weekly_shifts_test.csv')],
+                'weekly_shifts'
+            )
+            prefetched = []
+            for threshold in [identifiers - 1, identifiers]:
+                filename = os.path.join(directory, 'trace.json')
+                scheduleduty.main(
+                    'weekly_shifts',
+                    directory,
+                    'EXAMPLE_KEY',
+                    'Local Prefetch',
+                    'Level',
+                    'Multi',
+                    '2017-01-01',
+                    '2017-02-01',
+                    'UTC',
+                    1,
+                    30,
+                    rate_limit=0,
+                    base_url=self.stand_in.base_url,
+                    prefetch_threshold=threshold,
+                    trace_file=filename
+                )
+                with open(filename) as f:
+                    prefetched.append(any(
+                        event['name'] == 'prefetch_directory'
+                        for event in json.load(f)['traceEvents']
+                    ))
+        finally:
+            shutil.rmtree(directory)
+        # The directory is only indexed when more names than the threshold
+        # would be looked up
+        self.assertEqual(prefetched, [True, False])
+
+    def invalid_arguments(self):
+        stand_in = local_server.LocalPagerDuty(num_users=0, num_teams=0)
+        directory = tempfile.mkdtemp()
+        args = ['weekly_shifts', 'tests/csv', 'EXAMPLE_KEY', 'Local Invalid',
+                'Level', 'Multi', '2017-01-01', '2017-02-01', 'UTC', 1, 30]
+        kwargs = {'base_url': stand_in.start(), 'prefetch': True,
+                  'dry_run': os.path.join(directory, 'dry_run.jsonl')}
+        try:
+            with self.assertRaises(ValueError):
+                scheduleduty.main('unknown_type', *args[1:], **kwargs)
+            with self.assertRaises(ValueError):
+                scheduleduty.main(*args[:5] + [None] + args[6:], **kwargs)
+            with self.assertRaises(ValueError):
+                scheduleduty.main(*args, resume=True, **kwargs)
+            with self.assertRaises(Exception):
+                scheduleduty.main(*args[:1] + [directory] + args[2:],
+                                  **kwargs)
+            files = os.listdir(directory)
+        finally:
+            stand_in.stop()
+            shutil.rmtree(directory)
+        # Invalid invocations fail before the directory is fetched or the
+        # dry run output is opened
+        self.assertEqual(stand_in.stats, {})
+        self.assertEqual(files, [])
+
+    def import_weekly_shifts(self):
+        escalation_policy_id = scheduleduty.import_weekly_shifts(
+            self.pd_rest,
+            {
+                'filename': 'tests/csv/weekly_shifts_test.csv',
+                'base_name': 'Local Import'
+            },
+            'Level',
+            'Multi',
+            '2017-01-01',
+            '2017-02-01',
+            'UTC',
+            1,
+            30,
+            schedule_workers=4
+        )
+        self.assertIn(
+            escalation_policy_id,
+            self.stand_in.objects['escalation_policies']
+        )
+
+    def import_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ['a.csv', 'c.csv', 'd.csv']:
+                shutil.copy('tests/csv/weekly_shifts_test.csv',
+                            os.path.join(directory, name))
+            with open(os.path.join(directory, 'b.csv'), 'w') as f:
+                f.write('escalation_level,user_or_team,type,day_of_week,'
+                        'start_time,end_time\n'
+                        '1,Import User 1,Robot,Friday,0:00,9:00\n')
+            summary = scheduleduty.main(
+                'weekly_shifts',
+                directory,
+                'EXAMPLE_KEY',
+                'Local Parallel',
+                'Level',
+                'Multi',
+                '2017-01-01',
+                '2017-02-01',
+                'UTC',
+                1,
+                30,
+                file_workers=4,
+                base_url=self.stand_in.base_url
+            )
+        finally:
+            shutil.rmtree(directory)
+        # The malformed file is recorded without stopping the others, and
+        # the numbering follows the sorted filenames
+        self.assertEqual(
+            [(os.path.basename(result['filename']), result['base_name'])
+             for result in summary],
+            [('a.csv', 'Local Parallel #1'), ('b.csv', 'Local Parallel #2'),
+             ('c.csv', 'Local Parallel #3'), ('d.csv', 'Local Parallel #4')]
+        )
+        self.assertEqual([bool(result['error']) for result in summary],
+                         [False, True, False, False])
+        self.assertIsNone(summary[1]['id'])
+        escalation_policies = self.stand_in.objects['escalation_policies']
+        for result in [summary[0], summary[2], summary[3]]:
+            self.assertEqual(escalation_policies[result['id']]['name'],
+                             result['base_name'])
+        schedule_names = [
+            schedule['name']
+            for schedule in self.stand_in.objects['schedules'].values()
+            if schedule['name'].startswith('Local Parallel')
+        ]
+        self.assertEqual(sorted(schedule_names), sorted(
+            '{base_name} {suffix}'.format(base_name=base_name, suffix=suffix)
+            for base_name in ['Local Parallel #1', 'Local Parallel #3',
+                              'Local Parallel #4']
+            for suffix in ['Level 1 Multi 1', 'Level 1 Multi 2', 'Level 2']
+        ))
+
+    def reconcile(self):
+        file = {
+            'filename': 'tests/csv/weekly_shifts_test.csv',
+            'base_name': 'Local Reconcile'
+        }
+        # A schedule left by an earlier reconcile that is no longer produced
+        stale_id = self.pd_rest.create_schedule({'schedule': {
+            'name': 'Local Reconcile Level 9',
+            'description': scheduleduty.ReconcilingREST(
+                self.pd_rest,
+                file['base_name']
+            ).get_description('stale')
+        }})['schedule']['id']
+        results = []
+        for i in range(2):
+            reconciling_rest = scheduleduty.ReconcilingREST(
+                self.pd_rest,
+                file['base_name']
+            )
+            escalation_policy_id = scheduleduty.import_weekly_shifts(
+                reconciling_rest,
+                file,
+                'Level',
+                'Multi',
+                '2017-01-01',
+                '2017-02-01',
+                'UTC',
+                1,
+                30
+            )
+            results.append((escalation_policy_id,
+                            dict(reconciling_rest.finish())))
+        self.assertEqual(results[0][0], results[1][0])
+        self.assertEqual(results[0][1]['deleted'], 1)
+        self.assertNotIn(stale_id, self.stand_in.objects['schedules'])
+        self.assertEqual(results[1][1]['created'], 0)
+        self.assertEqual(results[1][1]['updated'], 0)
+        self.assertEqual(results[1][1]['deleted'], 0)
+        self.assertEqual(results[1][1]['unchanged'],
+                         results[0][1]['created'])
+
+    def reconcile_prefix(self):
+        args = ('Level', 'Multi', '2017-01-01', '2017-02-01', 'UTC', 1, 30)
+        objects = {}
+        for base_name in ['Local Prefix East', 'Local Prefix']:
+            reconciling_rest = scheduleduty.ReconcilingREST(
+                self.pd_rest,
+                base_name
+            )
+            scheduleduty.import_weekly_shifts(reconciling_rest, {
+                'filename': 'tests/csv/weekly_shifts_test.csv',
+                'base_name': base_name
+            }, *args)
+            counts = reconciling_rest.finish()
+            objects[base_name] = reconciling_rest.used
+        # Reconciling a base name that prefixes another leaves the other's
+        # objects alone
+        self.assertEqual(counts['deleted'], 0)
+        self.assertFalse(objects['Local Prefix East'] &
+                         objects['Local Prefix'])
+        for object_id in objects['Local Prefix East']:
+            self.assertTrue(
+                object_id in self.stand_in.objects['schedules'] or
+                object_id in self.stand_in.objects['escalation_policies']
+            )
+
+    def resume(self):
+        file = {
+            'filename': 'tests/csv/weekly_shifts_test.csv',
+            'base_name': 'Local Resume'
+        }
+        args = ('Level', 'Multi', '2017-01-01', '2017-02-01', 'UTC', 1, 30)
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'journal.jsonl')
+            journal = scheduleduty.Journal(filename)
+            file_key = journal.get_file_key(file['filename'])
+            with self.assertRaises(ValueError):
+                scheduleduty.import_weekly_shifts(scheduleduty.JournalREST(
+                    FailingEscalationPolicyREST(self.pd_rest),
+                    journal,
+                    file_key
+                ), file, *args)
+            journal.close()
+            schedules = len(self.stand_in.objects['schedules'])
+            journal = scheduleduty.Journal(filename, resume=True)
+            escalation_policy_id = scheduleduty.import_weekly_shifts(
+                scheduleduty.JournalREST(self.pd_rest, journal, file_key),
+                file,
+                *args
+            )
+            journal.close()
+        finally:
+            shutil.rmtree(directory)
+        # The schedules recorded before the failure are not created again
+        self.assertEqual(len(self.stand_in.objects['schedules']), schedules)
+        self.assertEqual(
+            self.stand_in.objects['escalation_policies']
+            [escalation_policy_id]['name'],
+            file['base_name']
+        )
+
+    def rollback(self):
+        schedules = dict(self.stand_in.objects['schedules'])
+        transaction_rest = scheduleduty.TransactionREST(
+            FailingEscalationPolicyREST(self.pd_rest)
+        )
+        with self.assertRaises(ValueError):
+            scheduleduty.import_weekly_shifts(
+                transaction_rest,
+                {
+                    'filename': 'tests/csv/weekly_shifts_test.csv',
+                    'base_name': 'Local Rollback'
+                },
+                'Level',
+                'Multi',
+                '2017-01-01',
+                '2017-02-01',
+                'UTC',
+                1,
+                30
+            )
+        self.assertTrue(transaction_rest.created)
+        # An object that is already gone is reported instead of deleted
+        transaction_rest.created.append(('escalation_policy', 'PMISSING'))
+        failed = transaction_rest.rollback()
+        self.assertEqual([result['id'] for result in failed], ['PMISSING'])
+        self.assertEqual(self.stand_in.objects['schedules'], schedules)
+        # Updates and deletions made by reconcile mode cannot be rolled back
+        with self.assertRaises(ValueError):
+            scheduleduty.main(
+                'weekly_shifts',
+                'tests/csv',
+                'EXAMPLE_KEY',
+                'Local Rollback',
+                'Level',
+                'Multi',
+                '2017-01-01',
+                '2017-02-01',
+                'UTC',
+                1,
+                30,
+                base_url=self.stand_in.base_url,
+                reconcile=True,
+                transactional=True
+            )
+
+    def rollback_failures(self):
+        handle = self.stand_in.handle
+
+        # Escalation policies cannot be deleted, so every rollback fails
+        def failing_handle(method, path, params, body):
+            if method == 'DELETE' and 'escalation_policies' in path:
+                return 500, {}, {'error': {'message': 'Injected error'}}
+            return handle(method, path, params, body)
+
+        directory = tempfile.mkdtemp()
+        self.stand_in.handle = failing_handle
+        try:
+            shutil.copy('tests/csv/weekly_shifts_test.csv',
+                        os.path.join(directory, 'a.csv'))
+            with open(os.path.join(directory, 'b.csv'), 'w') as f:
+                f.write('escalation_level,user_or_team,type,day_of_week,'
+                        'start_time,end_time\n'
+                        '1,Import User 1,Robot,Friday,0:00,9:00\n')
+            args = ('weekly_shifts', directory, 'EXAMPLE_KEY',
+                    'Local Rollback Failures', 'Level', 'Multi',
+                    '2017-01-01', '2017-02-01', 'UTC', 1, 30)
+            kwargs = {
+                'base_url': self.stand_in.base_url,
+                'max_retries': 1,
+                'backoff_cap': 0.01,
+                'transactional': True
+            }
+            # A failing file raises with the objects left behind
+            with self.assertRaises(ValueError) as context:
+                scheduleduty.main(*args, **kwargs)
+            failed = context.exception.rollback_failures
+            self.assertEqual([result['type'] for result in failed],
+                             ['escalation_policy'])
+            self.assertIn(failed[0]['id'],
+                          self.stand_in.objects['escalation_policies'])
+            self.assertTrue(failed[0]['error'])
+            # With parallel files they are added to the summary instead
+            summary = scheduleduty.main(*args, file_workers=2, **kwargs)
+            failed = summary[0]['rollback_failures']
+            self.assertEqual([result['type'] for result in failed],
+                             ['escalation_policy'])
+            self.assertIn(failed[0]['id'],
+                          self.stand_in.objects['escalation_policies'])
+            self.assertEqual([result['id'] for result in summary],
+                             [None, None])
+        finally:
+            self.stand_in.handle = handle
+            shutil.rmtree(directory)
+
+    def metrics(self):
+        pd_rest = scheduleduty.PagerDutyREST(
+            'EXAMPLE_KEY',
+            rate_limit=0,
+            base_url=self.stand_in.base_url
+        )
+        pd_rest.get_user_id(self.stand_in.users[2]['email'])
+        pd_rest.get_all('/users', 'users', {'query': 'Import User'})
+        schedule_id = pd_rest.create_schedule(
+            {'schedule': {'name': 'Local Metrics'}}
+        )['schedule']['id']
+        pd_rest.delete_schedule(schedule_id)
+        with self.assertRaises(ValueError):
+            pd_rest.delete_schedule(schedule_id)
+        endpoints = dict(
+            ((stats['operation'], stats['method'], stats['endpoint']), stats)
+            for stats in pd_rest.get_metrics()['endpoints']
+        )
+        # Calls to the same endpoint are told apart by the operation
+        self.assertEqual(sorted(endpoints), [
+            ('create_schedule', 'POST', '/schedules'),
+            ('delete_schedule', 'DELETE', '/schedules/{id}'),
+            ('get_all', 'GET', '/users'),
+            ('get_user_id', 'GET', '/users')
+        ])
+        self.assertEqual(
+            endpoints[('delete_schedule', 'DELETE', '/schedules/{id}')]
+            ['status_codes'],
+            {'204': 1, '404': 1}
+        )
+        self.assertGreater(
+            endpoints[('create_schedule', 'POST', '/schedules')]
+            ['bytes_sent'],
+            0
+        )
+        self.assertGreater(
+            endpoints[('get_user_id', 'GET', '/users')]['bytes_received'],
+            0
+        )
+        self.assertEqual(
+            sum(endpoints[('get_user_id', 'GET', '/users')]
+                ['latency_buckets']),
+            1
+        )
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'metrics.prom')
+            pd_rest.metrics.write_prometheus(filename)
+            with open(filename) as f:
+                lines = f.read().splitlines()
+        finally:
+            shutil.rmtree(directory)
+        self.assertIn('scheduleduty_api_requests_total{'
+                      'operation="delete_schedule",method="DELETE",'
+                      'endpoint="/schedules/{id}",status="404"} 1', lines)
+        self.assertIn('scheduleduty_api_request_duration_seconds_bucket{'
+                      'operation="get_user_id",method="GET",'
+                      'endpoint="/users",le="+Inf"} 1', lines)
+
+    def trace(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for name in ['first.csv', 'second.csv']:
+                shutil.copy('tests/csv/weekly_shifts_test.csv',
+                            os.path.join(directory, name))
+            filename = os.path.join(directory, 'trace.json')
+            scheduleduty.main(
+                'weekly_shifts',
+                directory,
+                'EXAMPLE_KEY',
+                'Local Trace',
+                'Level',
+                'Multi',
+                '2017-01-01',
+                '2017-02-01',
+                'UTC',
+                1,
+                30,
+                rate_limit=0,
+                base_url=self.stand_in.base_url,
+                prefetch=False,
+                schedule_workers=2,
+                file_workers=2,
+                trace_file=filename
+            )
+            with open(filename) as f:
+                events = json.load(f)['traceEvents']
+        finally:
+            shutil.rmtree(directory)
+        files = dict((event['args']['file'], event['pid'])
+                     for event in events if event['name'] == 'import_file')
+        self.assertEqual(len(files), 2)
+        self.assertEqual(len(set(files.values())), 2)
+        names = set()
+        for event in events:
+            if event['ph'] == 'M':
+                continue
+            names.add(event['name'])
+            # Spans recorded on the schedule worker threads are grouped
+            # under the file they belong to, like every other span
+            self.assertIn(event['args']['file'], files)
+            self.assertEqual(event['pid'], files[event['args']['file']])
+        # Each stage records the size of what it worked on
+        stream_levels = [event for event in events
+                         if event['name'] == 'stream_levels'][0]
+        with open('tests/csv/weekly_shifts_test.csv') as f:
+            rows = len(f.read().splitlines()) - 1
+        self.assertEqual(stream_levels['args']['rows'], rows)
+        # Import Team has a single member, so expansion keeps the count
+        self.assertEqual(stream_levels['args']['entries'], rows)
+        for name in ['stream_levels', 'get_time_periods', 'check_for_overlap',
+                     'concat_time_periods', 'get_schedule_payload',
+                     'create_schedule', 'create_escalation_policy',
+                     'POST /schedules', 'POST /escalation_policies']:
+            self.assertIn(name, names)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(LocalServerTests('lookups'))
+    suite.addTest(LocalServerTests('create_and_delete'))
+    suite.addTest(LocalServerTests('resolution_cache'))
+    suite.addTest(LocalServerTests('get_all'))
+    suite.addTest(LocalServerTests('ambiguous_directory'))
+    suite.addTest(LocalServerTests('prefetch_threshold'))
+    suite.addTest(LocalServerTests('rate_limit'))
+    suite.addTest(LocalServerTests('throttle'))
+    suite.addTest(LocalServerTests('shared_pause'))
+    suite.addTest(LocalServerTests('error_injection'))
+    suite.addTest(LocalServerTests('async_rest'))
+    suite.addTest(LocalServerTests('import_async'))
+    suite.addTest(LocalServerTests('invalid_arguments'))
+    suite.addTest(LocalServerTests('import_weekly_shifts'))
+    suite.addTest(LocalServerTests('import_files'))
+    suite.addTest(LocalServerTests('reconcile'))
+    suite.addTest(LocalServerTests('reconcile_prefix'))
+    suite.addTest(LocalServerTests('resume'))
+    suite.addTest(LocalServerTests('rollback'))
+    suite.addTest(LocalServerTests('rollback_failures'))
+    suite.addTest(LocalServerTests('metrics'))
+    suite.addTest(LocalServerTests('trace'))
+    return suite
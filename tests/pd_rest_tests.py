@@ -51,7 +51,12 @@ with open(input_filename) as input_file:
 with open(config_filname) as config_file:
     config = json.load(config_file)
 
-pd_rest = scheduleduty.PagerDutyREST(config['api_key'])
+# Fail fast instead of backing off when the REST API cannot be reached
+pd_rest = scheduleduty.PagerDutyREST(
+    config['api_key'],
+    max_retries=1,
+    backoff_cap=0.1
+)
 
 
 class PagerDutyRESTTests(unittest.TestCase):
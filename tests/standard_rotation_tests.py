@@ -53,7 +53,12 @@ with open(input_filename) as input_file:
 with open(config_filname) as config_file:
     config = json.load(config_file)
 
-pd_rest = scheduleduty.PagerDutyREST(config['api_key'])
+# Fail fast instead of backing off when the REST API cannot be reached
+pd_rest = scheduleduty.PagerDutyREST(
+    config['api_key'],
+    max_retries=1,
+    backoff_cap=0.1
+)
 standard_rotation = scheduleduty.StandardRotationLogic(
     config['start_date'],
     config['end_date'],
@@ -289,6 +294,19 @@ class StandardRotationTests(unittest.TestCase):
                 ['restriction_end_time']
             )
 
+    def get_restriction_durations(self):
+        cases = ['daily1', 'daily2', 'weekly1', 'weekly2']
+        expected_result = [expected['get_restriction_duration'][case]
+                           for case in cases]
+        actual_result = standard_rotation.get_restriction_durations([(
+            input['get_restriction_duration'][case]['restriction_type'],
+            input['get_restriction_duration'][case]['restriction_start_day'],
+            input['get_restriction_duration'][case]['restriction_start_time'],
+            input['get_restriction_duration'][case]['restriction_end_day'],
+            input['get_restriction_duration'][case]['restriction_end_time']
+        ) for case in cases])
+        self.assertEqual(expected_result, actual_result)
+
     def parse_csv(self):
         expected_result = expected['parse_csv']
         actual_result = standard_rotation.parse_csv(
@@ -358,6 +376,13 @@ class StandardRotationTests(unittest.TestCase):
                 input['get_datetime']['error']['time']
             )
 
+    def get_time_seconds(self):
+        self.assertEqual(standard_rotation.get_time_seconds('07:43:28'), 27808)
+        self.assertEqual(standard_rotation.get_time_seconds('7:43'), 27780)
+        for time in ('24:00', '07:60', '07:43:28:00', '03', 'ab:cd'):
+            with self.assertRaises(ValueError):
+                standard_rotation.get_time_seconds(time)
+
     def start_date_timedelta(self):
         tz = pytz.timezone("UTC")
         expected_result = expected['start_date_timedelta']['less']
@@ -484,8 +509,10 @@ def suite():
     suite.addTest(StandardRotationTests('get_rotation_turn_length'))
     suite.addTest(StandardRotationTests('get_virtual_start'))
     suite.addTest(StandardRotationTests('get_restriction_duration'))
+    suite.addTest(StandardRotationTests('get_restriction_durations'))
     suite.addTest(StandardRotationTests('parse_csv'))
     suite.addTest(StandardRotationTests('get_datetime'))
+    suite.addTest(StandardRotationTests('get_time_seconds'))
     suite.addTest(StandardRotationTests('start_date_timedelta'))
     suite.addTest(StandardRotationTests('get_weekday'))
     suite.addTest(StandardRotationTests('nullify'))
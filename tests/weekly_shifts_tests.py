@@ -29,6 +29,8 @@ import unittest
 import sys
 import json
 import os
+import copy
+from StringIO import StringIO
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from scheduleduty import scheduleduty  # NOQA
 
@@ -51,7 +53,12 @@ with open(input_filename) as input_file:
 with open(config_filname) as config_file:
     config = json.load(config_file)
 
-pd_rest = scheduleduty.PagerDutyREST(config['api_key'])
+# Fail fast instead of backing off when the REST API cannot be reached
+pd_rest = scheduleduty.PagerDutyREST(
+    config['api_key'],
+    max_retries=1,
+    backoff_cap=0.1
+)
 weekly_shifts = scheduleduty.WeeklyShiftLogic(
     config['base_name'],
     config['level_name'],
@@ -64,6 +71,37 @@ weekly_shifts = scheduleduty.WeeklyShiftLogic(
 )
 
 
+class ScheduleNameREST():
+    """Stand-in for PagerDutyREST that uses schedule names as IDs"""
+
+    def create_schedule(self, payload):
+        return {'schedule': {'id': payload['schedule']['name']}}
+
+
+class DirectoryREST():
+    """Stand-in for PagerDutyREST that resolves users from a dictionary"""
+
+    users = {
+        'Import User 1': 'PAAAAAA',
+        'Import User 2': 'PBBBBBB',
+        'Import User 3': 'PCCCCCC',
+        'lucas+import4@pagerduty.com': 'PDDDDDD'
+    }
+
+    def get_team_id(self, team_name):
+        return 'PTEAMID'
+
+    def iter_users_in_team(self, team_id):
+        return iter([{'email': 'lucas+import4@pagerduty.com'}])
+
+    def get_users_in_team(self, team_id):
+        return list(self.iter_users_in_team(team_id))
+
+    def get_user_id(self, user_query):
+        # IDs resolve to themselves like the PagerDutyREST cache
+        return self.users.get(user_query, user_query)
+
+
 class WeeklyShiftsTests(unittest.TestCase):
 
     def create_days_of_week(self):
@@ -73,6 +111,20 @@ class WeeklyShiftsTests(unittest.TestCase):
         )
         self.assertEqual(expected_result, actual_result)
 
+    def create_days_of_week_values(self):
+        expected_result = expected['create_days_of_week_values']
+        actual_result = weekly_shifts.create_days_of_week(
+         'tests/csv/weekly_shifts_days.csv'
+        )
+        self.assertEqual(expected_result, actual_result)
+
+    def create_days_of_week_blank_lines(self):
+        expected_result = expected['create_days_of_week']
+        actual_result = weekly_shifts.create_days_of_week(
+         'tests/csv/weekly_shifts_blank_lines.csv'
+        )
+        self.assertEqual(expected_result, actual_result)
+
     def split_teams_into_users(self):
         expected_result = expected['split_teams_into_users']
         actual_result = weekly_shifts.split_teams_into_users(
@@ -96,6 +148,38 @@ class WeeklyShiftsTests(unittest.TestCase):
         )
         self.assertEqual(expected_result, actual_result)
 
+    def stream_levels(self):
+        days = weekly_shifts.create_days_of_week(
+         'tests/csv/weekly_shifts_test.csv'
+        )
+        days = weekly_shifts.split_teams_into_users(DirectoryREST(), days)
+        days = weekly_shifts.get_user_ids(DirectoryREST(), days)
+        expected_result = weekly_shifts.split_days_by_level([{
+            'schedules': [{'name': weekly_shifts.base_name, 'days': days}]
+        }])
+        actual_result = weekly_shifts.stream_levels(
+         DirectoryREST(),
+         'tests/csv/weekly_shifts_test.csv'
+        )
+        self.assertEqual(expected_result, actual_result)
+
+    def max_level_targets(self):
+        # 30 targets on Monday split 15/15 across two levels are allowed
+        filename = 'tests/csv/weekly_shifts_targets.csv'
+        days = weekly_shifts.create_days_of_week(filename)
+        days = weekly_shifts.split_teams_into_users(DirectoryREST(), days)
+        self.assertEqual(30, len(days[1]['entries']))
+        levels = weekly_shifts.stream_levels(DirectoryREST(), filename)
+        self.assertEqual([15, 15], [len(level['schedules'][0]['days'][1])
+                                    for level in levels])
+        # 26 targets on a single level are rejected by both paths
+        filename = 'tests/csv/weekly_shifts_too_many_targets.csv'
+        days = weekly_shifts.create_days_of_week(filename)
+        self.assertRaises(ValueError, weekly_shifts.split_teams_into_users,
+                          DirectoryREST(), days)
+        self.assertRaises(ValueError, weekly_shifts.stream_levels,
+                          DirectoryREST(), filename)
+
     def get_time_periods(self):
         expected_result = expected['get_time_periods']
         actual_result = weekly_shifts.get_time_periods(
@@ -103,6 +187,13 @@ class WeeklyShiftsTests(unittest.TestCase):
         )
         self.assertEqual(expected_result, actual_result)
 
+    def get_time_periods_overlap(self):
+        expected_result = expected['get_time_periods_overlap']
+        actual_result = weekly_shifts.get_time_periods(
+         input['get_time_periods_overlap']
+        )
+        self.assertEqual(expected_result, actual_result)
+
     def check_for_overlap(self):
         expected_result = expected['check_for_overlap']
         actual_result = weekly_shifts.check_for_overlap(
@@ -110,6 +201,13 @@ class WeeklyShiftsTests(unittest.TestCase):
         )
         self.assertEqual(expected_result, actual_result)
 
+    def check_for_overlap_packing(self):
+        expected_result = expected['check_for_overlap_packing']
+        actual_result = weekly_shifts.check_for_overlap(
+         expected['get_time_periods_overlap']
+        )
+        self.assertEqual(expected_result, actual_result)
+
     def concat_time_periods(self):
         expected_result = expected['concat_time_periods']
         actual_result = weekly_shifts.concat_time_periods(
@@ -117,6 +215,13 @@ class WeeklyShiftsTests(unittest.TestCase):
         )
         self.assertEqual(expected_result, actual_result)
 
+    def concat_time_periods_midnight(self):
+        expected_result = expected['concat_time_periods_midnight']
+        actual_result = weekly_shifts.concat_time_periods(
+         input['concat_time_periods_midnight']
+        )
+        self.assertEqual(expected_result, actual_result)
+
     def get_schedule_payload(self):
         expected_result = expected['get_schedule_payload']
         actual_result = weekly_shifts.get_schedule_payload(
@@ -124,6 +229,81 @@ class WeeklyShiftsTests(unittest.TestCase):
         )
         self.assertEqual(expected_result, actual_result)
 
+    def get_schedule_payloads(self):
+        expected_result = [expected['get_schedule_payload']] * 2
+        actual_result = weekly_shifts.get_schedule_payloads(
+            [input['get_schedule_payload']] * 2
+        )
+        self.assertEqual(expected_result, actual_result)
+
+    def create_schedules(self):
+        expected_result = [
+            {'schedules': [
+                'Weekly Shifts Test Level 1 Multi 1',
+                'Weekly Shifts Test Level 1 Multi 2'
+            ]},
+            {'schedules': ['Weekly Shifts Test Level 2']}
+        ]
+        actual_result = weekly_shifts.create_schedules(
+         ScheduleNameREST(),
+         copy.deepcopy(expected['check_for_overlap']),
+         4
+        )
+        self.assertEqual(expected_result, actual_result)
+
+    def dry_run(self):
+        output = StringIO()
+        dry_run_rest = scheduleduty.DryRunREST(
+            output,
+            scheduleduty.LocalResolver(
+                input['dry_run']['users'],
+                input['dry_run']['teams']
+            )
+        )
+        actual_result = scheduleduty.import_weekly_shifts(
+            dry_run_rest,
+            {
+                'filename': 'tests/csv/weekly_shifts_test.csv',
+                'base_name': config['base_name']
+            },
+            config['level_name'],
+            config['multi_name'],
+            config['start_date'],
+            config['end_date'],
+            config['time_zone'],
+            config['num_loops'],
+            config['escalation_delay']
+        )
+        lines = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(lines[-1]['id'], actual_result)
+        self.assertEqual(lines[-1]['type'], 'escalation_policy')
+        targets = [
+            target['id'] for rule in
+            lines[-1]['payload']['escalation_policy']['escalation_rules']
+            for target in rule['targets']
+        ]
+        self.assertEqual([line['id'] for line in lines[:-1]], targets)
+        with self.assertRaises(ValueError):
+            dry_run_rest.get_user_id('Unknown User')
+        # Placeholder IDs must never reach a journal that --resume trusts
+        with self.assertRaises(ValueError):
+            scheduleduty.main(
+                'weekly_shifts',
+                'tests/csv',
+                'EXAMPLE_KEY',
+                config['base_name'],
+                config['level_name'],
+                config['multi_name'],
+                config['start_date'],
+                config['end_date'],
+                config['time_zone'],
+                config['num_loops'],
+                config['escalation_delay'],
+                dry_run=StringIO(),
+                journal='unused_journal.jsonl'
+            )
+        self.assertFalse(os.path.exists('unused_journal.jsonl'))
+
     def get_escalation_policy_payload(self):
         expected_result = expected['get_escalation_policy_payload']
         actual_result = weekly_shifts.get_escalation_policy_payload(
@@ -135,12 +315,22 @@ class WeeklyShiftsTests(unittest.TestCase):
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(WeeklyShiftsTests('create_days_of_week'))
+    suite.addTest(WeeklyShiftsTests('create_days_of_week_values'))
+    suite.addTest(WeeklyShiftsTests('create_days_of_week_blank_lines'))
     suite.addTest(WeeklyShiftsTests('split_teams_into_users'))
     suite.addTest(WeeklyShiftsTests('get_user_ids'))
     suite.addTest(WeeklyShiftsTests('split_days_by_level'))
+    suite.addTest(WeeklyShiftsTests('stream_levels'))
+    suite.addTest(WeeklyShiftsTests('max_level_targets'))
     suite.addTest(WeeklyShiftsTests('get_time_periods'))
+    suite.addTest(WeeklyShiftsTests('get_time_periods_overlap'))
     suite.addTest(WeeklyShiftsTests('check_for_overlap'))
+    suite.addTest(WeeklyShiftsTests('check_for_overlap_packing'))
     suite.addTest(WeeklyShiftsTests('concat_time_periods'))
+    suite.addTest(WeeklyShiftsTests('concat_time_periods_midnight'))
     suite.addTest(WeeklyShiftsTests('get_schedule_payload'))
+    suite.addTest(WeeklyShiftsTests('get_schedule_payloads'))
+    suite.addTest(WeeklyShiftsTests('create_schedules'))
     suite.addTest(WeeklyShiftsTests('get_escalation_policy_payload'))
+    suite.addTest(WeeklyShiftsTests('dry_run'))
     return suite